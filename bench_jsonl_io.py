@@ -0,0 +1,109 @@
+import os
+import time
+import json
+import argparse
+import jsonl_io
+
+# Disk footprint and wall-clock cost of compressing the jsonl files of each pipeline stage.
+# Every file is re-written with each codec and read back line by line (json parsing included).
+
+def get_stage_files(work_dir, dataset):
+    sql_data_dir = os.path.join(work_dir, 'open_table_discovery/table2question/dataset', dataset, 'sql_data')
+    stage_files = [
+        ('tables', os.path.join(work_dir, 'data', dataset, 'tables', 'tables.jsonl')),
+        ('passages', os.path.join(work_dir, 'index/on_disk_index_%s_rel_graph' % dataset, 'passages.jsonl')),
+        ('fusion_retrieved', os.path.join(sql_data_dir, 'dev', 'rel_graph', 'fusion_retrieved.jsonl')),
+        ('fusion_retrieved_tagged', os.path.join(sql_data_dir, 'dev', 'rel_graph', 'fusion_retrieved_tagged.jsonl')),
+    ]
+    return [(a, jsonl_io.resolve_file(b)) for a, b in stage_files if jsonl_io.exists(b)]
+
+def read_lines(data_file, max_lines):
+    lines = []
+    with jsonl_io.open_file(data_file) as f:
+        for line in f:
+            lines.append(line)
+            if (max_lines > 0) and (len(lines) >= max_lines):
+                break
+    return lines
+
+def time_read(data_file):
+    t1 = time.time()
+    with jsonl_io.open_file(data_file) as f:
+        for line in f:
+            json.loads(line)
+    return time.time() - t1
+
+def time_write(lines, out_file, level, threads):
+    t1 = time.time()
+    with jsonl_io.open_file(out_file, 'w', level=level, threads=threads) as f_o:
+        for line in lines:
+            f_o.write(line)
+    return time.time() - t1
+
+def bench_file(stage, data_file, args):
+    lines = read_lines(data_file, args.max_lines)
+    bench_dir = os.path.join(args.out_dir, stage)
+    if not os.path.isdir(bench_dir):
+        os.makedirs(bench_dir)
+    result_lst = []
+    codec_lst = [('plain', '', None)]
+    for level in args.zstd_levels:
+        codec_lst.append(('zstd-%d' % level, jsonl_io.ZSTD_EXT, level))
+    for level in args.gzip_levels:
+        codec_lst.append(('gzip-%d' % level, jsonl_io.GZIP_EXT, level))
+
+    for codec, ext, level in codec_lst:
+        out_file = os.path.join(bench_dir, 'bench.jsonl' + ext)
+        write_time = time_write(lines, out_file, level, args.threads)
+        read_time = time_read(out_file)
+        result = {
+            'stage':stage,
+            'codec':codec,
+            'lines':len(lines),
+            'size_mb':os.path.getsize(out_file) / (1024 * 1024),
+            'write_sec':write_time,
+            'read_sec':read_time
+        }
+        result_lst.append(result)
+        os.remove(out_file)
+    plain_size = result_lst[0]['size_mb']
+    for result in result_lst:
+        result['ratio'] = plain_size / max(result['size_mb'], 1e-9)
+    return result_lst
+
+def show_results(result_lst):
+    print('%-25s %-8s %10s %10s %8s %10s %10s' % ('stage', 'codec', 'lines', 'size(MB)', 'ratio', 'write(s)', 'read(s)'))
+    for result in result_lst:
+        print('%-25s %-8s %10d %10.2f %8.2f %10.2f %10.2f' % (result['stage'], result['codec'], result['lines'],
+              result['size_mb'], result['ratio'], result['write_sec'], result['read_sec']))
+
+def main(args):
+    if len(args.files) > 0:
+        stage_files = [(os.path.basename(a), a) for a in args.files]
+    else:
+        stage_files = get_stage_files(args.work_dir, args.dataset)
+    if len(stage_files) == 0:
+        print('No jsonl files to benchmark')
+        return
+    all_result_lst = []
+    for stage, data_file in stage_files:
+        print('benchmarking %s (%s)' % (stage, data_file))
+        all_result_lst.extend(bench_file(stage, data_file, args))
+    show_results(all_result_lst)
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--work_dir', type=str)
+    parser.add_argument('--dataset', type=str)
+    parser.add_argument('--files', type=str, nargs='*', default=[])
+    parser.add_argument('--out_dir', type=str, default='./bench_jsonl_io')
+    parser.add_argument('--max_lines', type=int, default=0)
+    parser.add_argument('--zstd_levels', type=int, nargs='*', default=[3, 10])
+    parser.add_argument('--gzip_levels', type=int, nargs='*', default=[6])
+    parser.add_argument('--threads', type=int, default=-1)
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    args = get_args()
+    main(args)
@@ -1,25 +1,45 @@
 import argparse
 import os
+import json
 from tqdm import tqdm
 import glob
+import pickle
 from table2txt import table2graph
+from table2txt import row_budget
+from table2txt import passage_dedup
+from table2txt import graph_state
 import table_from_csv
+import table_store
+import jsonl_io
 import generate_passage_embeddings as passage_encoder
 from src import ondisk_index
 import shutil
 
-def get_csv_args(work_dir, dataset):
+def get_csv_args(work_dir, dataset, num_workers):
     csv_args = argparse.Namespace(work_dir=work_dir,
-                                  dataset=dataset
+                                  dataset=dataset,
+                                  num_workers=num_workers,
+                                  chunk_size=64,
+                                  stream_min_mb=64,
+                                  max_chunk_rows=0,
+                                  dedup=1
                                  )
     return csv_args 
 
-def get_graph_args(work_dir, dataset):
+def get_graph_args(work_dir, dataset, num_workers, shard_size, max_table_rows, incremental=0):
     graph_args = argparse.Namespace(work_dir=work_dir, 
                                     dataset=dataset,
                                     experiment='rel_graph',
                                     table_file='tables.jsonl',
-                                    strategy='RelationGraph'
+                                    strategy='RelationGraph',
+                                    num_workers=num_workers,
+                                    chunk_size=16,
+                                    shard_size=shard_size,
+                                    max_table_rows=max_table_rows,
+                                    row_seed=0,
+                                    dedup_passages=1,
+                                    compress='',
+                                    incremental=incremental
                                     )
     return graph_args
 
@@ -58,13 +78,19 @@ def confirm(args):
     tables_csv_exists = exists_tables_csv(dataset_dir)
     args.tables_csv_exists = tables_csv_exists 
     table_exists = os.path.exists(tables_file)
-    passage_exists = os.path.exists(passage_file)
+    passage_exists = jsonl_io.exists(passage_file)
     index_exists = os.path.exists(index_dir)
     if tables_csv_exists:
-        if table_exists:
+        # tables imported with a manifest are updated incrementally by table_from_csv
+        manifest_file = table_from_csv.get_manifest_file(tables_file)
+        if table_exists and (not os.path.exists(manifest_file)):
             os.remove(tables_file)
+    table2graph.remove_shards(passage_file)
+    if args.incremental:
+        # passages.jsonl and its embeddings are updated, the index is rebuilt from the embeddings
+        return True
     if passage_exists:
-        os.remove(passage_file)
+        os.remove(jsonl_io.resolve_file(passage_file))
     if index_exists: 
         confirmed = input('Index already exists. If continue, index will be rebuilt. \n' +
                           'Do you want to continue(y/n)? ')
@@ -76,6 +102,22 @@ def confirm(args):
     else:
         return True
 
+def drop_retired_embeddings(emb_file_lst, retired_range_lst, kept_p_id_set):
+    # the embedding files of earlier runs keep (ids, embeddings), retired passages are removed from them
+    if len(retired_range_lst) == 0:
+        return
+    for emb_file in emb_file_lst:
+        with open(emb_file, 'rb') as f:
+            ids, embeddings = pickle.load(f)
+        keep_lst = [idx for idx, p_id in enumerate(ids) if (int(p_id) in kept_p_id_set) or 
+                    (not graph_state.is_retired(retired_range_lst, int(p_id)))]
+        if len(keep_lst) == len(ids):
+            continue
+        tmp_file = emb_file + '.tmp'
+        with open(tmp_file, 'wb') as f_o:
+            pickle.dump(([ids[a] for a in keep_lst], embeddings[keep_lst]), f_o)
+        os.replace(tmp_file, emb_file)
+
 def main():
     args = get_args()
     if not confirm(args):
@@ -83,62 +125,84 @@ def main():
     
     if args.tables_csv_exists:
         print('Importing tables')
-        csv_args = get_csv_args(args.work_dir, args.dataset)
+        csv_args = get_csv_args(args.work_dir, args.dataset, args.num_workers)
         msg_info = table_from_csv.main(csv_args)
         if not msg_info['state']:
             print(msg_info['msg'])
             return
 
+    # tables.tbl gives trainer and tester random access to the tables without parsing tables.jsonl
+    table_store.update_store_file(table_store.get_table_file(args.work_dir, args.dataset))
+
     print('Linearizing table rows')
-    graph_args = get_graph_args(args.work_dir, args.dataset)
+    graph_args = get_graph_args(args.work_dir, args.dataset, args.num_workers, args.batch_size,
+                                args.max_table_rows, incremental=args.incremental)
     msg_info = table2graph.main(graph_args)
     graph_ok = msg_info['state']
     if not graph_ok:
         return
     
     graph_file = msg_info['out_file']
-    part_file_lst = split_graphs(graph_file, args.batch_size)
+    # the index copy of passages.jsonl is plain text, the retriever and the on-disk indexer read it directly
+    graph_base_file = msg_info['passage_file']
+    # the passages are already sharded by table2graph
+    shard_manifest_file = msg_info['shard_manifest']
+    with open(shard_manifest_file) as f:
+        shard_manifest = json.load(f)
+    part_file_lst = [a['file'] for a in shard_manifest['shards']]
+    assert(args.incremental or (len(part_file_lst) > 0))
     encoder_model = os.path.join(args.work_dir, 'models/tqa_retriever')
     emd_file_suffix = '_embeddings'
+    emb_pattern = '*' + emd_file_suffix + '_*'
+    prev_emb_file_lst = glob.glob(os.path.join(glob.escape(os.path.dirname(graph_base_file)), emb_pattern))
+    # with --incremental, the embeddings of every run are kept next to passages.jsonl, named by run
+    run_suffix = ('_run_%d' % msg_info['run']) if args.incremental else ''
     out_emd_file_lst = []
     for part_file in part_file_lst:
         print('Encoding %s' % part_file)
         encoder_args = get_encoder_args(encoder_model)
         encoder_args.passages = part_file
-        encoder_args.output_path = part_file + emd_file_suffix
+        encoder_args.output_path = part_file + run_suffix + emd_file_suffix
         out_emd_file_lst.append(encoder_args.output_path)
         passage_encoder.main(encoder_args, is_main=False) 
         os.remove(part_file)
     
-    index_args = get_index_args(args.work_dir, args.dataset, '*' + emd_file_suffix + '_*')
+    if args.incremental:
+        drop_retired_embeddings(prev_emb_file_lst, msg_info['retired_ranges'], msg_info['kept_p_ids'])
+        index_dir = os.path.join(args.work_dir, 'index/on_disk_index_%s_rel_graph' % args.dataset)
+        if os.path.isdir(index_dir):
+            shutil.rmtree(index_dir)
+
+    index_args = get_index_args(args.work_dir, args.dataset, emb_pattern)
     msg_info = ondisk_index.main(index_args)
     if not msg_info['state']:
         print(msg_info['msg'])
     index_dir = msg_info['index_dir']
     assert(os.path.isdir(index_dir))
-    shutil.move(graph_file, index_dir)
+    # the rows indexed for tables over the row budget (the other rows are read from the table store)
+    # and the tags of duplicate passages, expanded at retrieval
+    side_file_lst = [row_budget.get_sample_file(graph_base_file), passage_dedup.get_posting_file(graph_base_file)]
+    # an incremental run keeps passages.jsonl and the side files for the next run
+    copy_func = shutil.copy if args.incremental else shutil.move
+    copy_func(graph_file, index_dir)
+    for side_file in side_file_lst:
+        if os.path.exists(side_file):
+            copy_func(side_file, index_dir)
+    os.remove(shard_manifest_file)
+    if args.incremental:
+        return
     for out_emd_file in out_emd_file_lst:
-        cmd = 'rm %s_*' % out_emd_file
-        os.system(cmd)
-               
-def split_graphs(graph_file, batch_size):
-    out_file_prefix = graph_file + '_part_'
-    part_file_lst = glob.glob(out_file_prefix + '*')
-    if len(part_file_lst) > 0:
-        cmd = 'rm ' + out_file_prefix + '*'
-        os.system(cmd)
-    cmd = 'split -l %d %s %s' % (batch_size, graph_file, out_file_prefix)
-    os.system(cmd)
-    part_file_lst = glob.glob(out_file_prefix + '*')
-    part_file_lst.sort()
-    assert(len(part_file_lst) > 0)
-    return part_file_lst 
+        for emb_shard_file in glob.glob(glob.escape(out_emd_file) + '_*'):
+            os.remove(emb_shard_file)
 
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('--work_dir', type=str, required=True)
     parser.add_argument('--dataset', type=str, required=True)
     parser.add_argument('--batch_size', type=int, default=5000000)
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--max_table_rows', type=int, default=0)
+    parser.add_argument('--incremental', type=int, default=0)
     args = parser.parse_args()
     return args
 
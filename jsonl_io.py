@@ -0,0 +1,81 @@
+import io
+import os
+import gzip
+import json
+
+# Transparent (de)compression for the jsonl files of the pipeline.
+# A file ending with .zst or .gz is compressed, and a reader asked for 'x.jsonl' also finds 'x.jsonl.zst' or
+# 'x.jsonl.gz'. zstd needs the optional 'zstandard' package and compresses with one thread per core;
+# gzip is single threaded.
+
+ZSTD_EXT = '.zst'
+GZIP_EXT = '.gz'
+COMPRESS_EXT_LST = [ZSTD_EXT, GZIP_EXT]
+
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 6
+
+def get_zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('zstandard is needed for %s files, install it by "pip install zstandard"' % ZSTD_EXT)
+    return zstandard
+
+def is_compressed(data_file):
+    return os.path.splitext(data_file)[1] in COMPRESS_EXT_LST
+
+def resolve_file(data_file):
+    if os.path.exists(data_file):
+        return data_file
+    for ext in COMPRESS_EXT_LST:
+        if os.path.exists(data_file + ext):
+            return data_file + ext
+    return data_file
+
+def exists(data_file):
+    return os.path.exists(resolve_file(data_file))
+
+def open_file(data_file, mode='r', level=None, threads=-1):
+    # mode is one of 'r', 'w', 'a', 'rb', 'wb', 'ab'
+    binary = mode.endswith('b')
+    base_mode = mode[0]
+    if base_mode == 'r':
+        data_file = resolve_file(data_file)
+    ext = os.path.splitext(data_file)[1]
+    if ext == ZSTD_EXT:
+        zstandard = get_zstd()
+        if base_mode == 'r':
+            f = open(data_file, 'rb')
+            dctx = zstandard.ZstdDecompressor()
+            stream = dctx.stream_reader(f, read_across_frames=True, closefd=True)
+            stream = io.BufferedReader(stream)
+        else:
+            # appending starts a new zstd frame, readers read across frames
+            f = open(data_file, base_mode + 'b')
+            cctx = zstandard.ZstdCompressor(level=(level or ZSTD_LEVEL), threads=threads)
+            stream = cctx.stream_writer(f, closefd=True)
+        if binary:
+            return stream
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    elif ext == GZIP_EXT:
+        if base_mode == 'r':
+            return gzip.open(data_file, mode if binary else 'rt', encoding=(None if binary else 'utf-8'))
+        return gzip.open(data_file, base_mode + ('b' if binary else 't'), compresslevel=(level or GZIP_LEVEL),
+                         encoding=(None if binary else 'utf-8'))
+    if binary:
+        return open(data_file, mode)
+    return open(data_file, mode, encoding='utf-8')
+
+def iter_jsonl(data_file):
+    with open_file(data_file) as f:
+        for line in f:
+            yield json.loads(line)
+
+def read_jsonl(data_file):
+    return list(iter_jsonl(data_file))
+
+def write_jsonl(data, data_file, mode='w'):
+    with open_file(data_file, mode) as f_o:
+        for item in data:
+            f_o.write(json.dumps(item) + '\n')
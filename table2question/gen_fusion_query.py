@@ -2,6 +2,9 @@ import json
 import os
 import argparse
 from tqdm import tqdm
+import table_store
+import jsonl_io
+import table_cluster
 
 def get_args():
     parser = argparse.ArgumentParser()
@@ -13,7 +16,7 @@ def get_args():
 
 def read_meta(meta_file):
     meta_data = []
-    with open(meta_file) as f:
+    with jsonl_io.open_file(meta_file) as f:
         for line in tqdm(f):
             item = json.loads(line)
             meta_data.append(item)
@@ -21,25 +24,21 @@ def read_meta(meta_file):
 
 def read_questions(q_file):
     questions = []
-    with open(q_file) as f:
+    with jsonl_io.open_file(q_file) as f:
         for line in tqdm(f):
             questions.append(line.strip())
     return questions
 
 def read_tables(work_dir, dataset):
-    table_dict = {}
+    table_dict = table_store.load_dataset_table_dict(work_dir, dataset)
     table_title_dict = {} 
-    table_file = os.path.join(work_dir, 'data/%s/tables/tables.jsonl' % dataset)
-    with open(table_file) as f:
-        for line in tqdm(f):
-            item = json.loads(line)
-            table_dict[item['tableId']] = item
-            title = item['documentTitle'].strip().lower()
-            if title not in table_title_dict:
-                table_title_dict[title] = []
-            
-            same_title_tables = table_title_dict[title]
-            same_title_tables.append(item)
+    for item in table_store.load_dataset_tables(work_dir, dataset):
+        title = item['documentTitle'].strip().lower()
+        if title not in table_title_dict:
+            table_title_dict[title] = []
+        
+        same_title_tables = table_title_dict[title]
+        same_title_tables.append(item)
 
     return (table_dict, table_title_dict)
 
@@ -48,7 +47,7 @@ def get_table_col_names(table):
     col_names = [a['text'].strip().lower() for a in columns]
     return col_names
 
-def get_gold_tables(meta_item, table_dict, table_title_dict):
+def get_gold_tables(meta_item, table_dict, table_title_dict, table_cluster_dict=None):
     table_id = meta_item['table_id']
     meta_table = table_dict[table_id]
     row = meta_item['row']
@@ -62,13 +61,19 @@ def get_gold_tables(meta_item, table_dict, table_title_dict):
         meta_row_info = meta_table['rows'][row]
 
     title = meta_table['documentTitle'].strip().lower()
-    same_title_tables = table_title_dict[title]
+    cand_tables = list(table_title_dict[title])
+    if table_cluster_dict:
+        # near-duplicate revisions precomputed by table_cluster can have another title
+        cand_id_set = set([a['tableId'] for a in cand_tables])
+        for cluster_table_id in table_cluster_dict.get(table_id, []):
+            if (cluster_table_id not in cand_id_set) and (cluster_table_id in table_dict):
+                cand_tables.append(table_dict[cluster_table_id])
     
     gold_table_id_set = set([table_id])
 
     meta_table_col_names = get_table_col_names(meta_table)
 
-    for other_table in same_title_tables:
+    for other_table in cand_tables:
         if other_table['tableId'] == table_id:
             continue
         
@@ -77,7 +82,9 @@ def get_gold_tables(meta_item, table_dict, table_title_dict):
             continue
         
         if meta_row_info is None:
-            gold_table_id_set.add(other_table['tableId'])
+            # the sql condition is ('about', =, Title)
+            if other_table['documentTitle'].strip().lower() == title:
+                gold_table_id_set.add(other_table['tableId'])
         else:
             if is_gold_table(other_table, other_col_names, meta_table, meta_row_info, cond_cols, meta_table_col_names):
                 gold_table_id_set.add(other_table['tableId'])
@@ -86,6 +93,13 @@ def get_gold_tables(meta_item, table_dict, table_title_dict):
     return gold_table_id_lst          
 
 
+def expand_table_alias(table_id_lst, table_alias_dict):
+    # exact duplicates are not indexed, but they answer the question as well as their representative
+    out_table_id_lst = list(table_id_lst)
+    for table_id in table_id_lst:
+        out_table_id_lst.extend(table_alias_dict.get(table_id, []))
+    return out_table_id_lst
+
 def is_gold_table(other_table, other_col_names, meta_table, meta_row_info, cond_cols, meta_table_col_names):
     other_table_row_data = other_table['rows']
     for other_row_info in other_table_row_data:
@@ -117,20 +131,23 @@ def main(args):
     meta_file = os.path.join(data_dir, 'meta.txt')
     q_file = os.path.join(data_dir, 'questions.txt')
     out_query_file = os.path.join(data_dir, 'fusion_query.jsonl')
-    if os.path.exists(out_query_file):
+    if jsonl_io.exists(out_query_file):
         err_msg = '(%s) already exists' % out_query_file
         print(err_msg)
         return 
      
-    f_o_query = open(out_query_file, 'w') 
+    f_o_query = jsonl_io.open_file(out_query_file, 'w') 
     meta_data = read_meta(meta_file)
     q_data = read_questions(q_file)
    
     table_dict, table_title_dict = read_tables(args.work_dir, args.dataset) 
+    table_alias_dict = table_store.load_dataset_table_alias(args.work_dir, args.dataset)
+    table_cluster_dict = table_cluster.load_dataset_table_clusters(args.work_dir, args.dataset, parent_ids=True)
     for idx, question in tqdm(enumerate(q_data)):
         meta_item = meta_data[idx]
         qid = meta_item['qid']
-        table_id_lst = get_gold_tables(meta_item, table_dict, table_title_dict)
+        table_id_lst = get_gold_tables(meta_item, table_dict, table_title_dict, table_cluster_dict)
+        table_id_lst = expand_table_alias(table_id_lst, table_alias_dict)
         answers = ['N/A']       
         #passage_info = {
         #    'title':'',
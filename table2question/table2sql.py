@@ -10,18 +10,19 @@ from table2question.sql_data import SqlQuery
 from table2question.wikisql_preprocess import get_sql_text
 import re
 import time
+import hashlib
+import collections
+import table_store
 
 g_tokenizer = None
 
 def read_table_file(table_lst, data_file, table_filter_set):
-    with open(data_file) as f:
-        for line in tqdm(f):
-            table = json.loads(line)
-            table_id = table['tableId']
-            if table_filter_set is not None:
-                if table_id not in table_filter_set:
-                    continue
-            table_lst.append(table)
+    for table in table_store.load_tables(data_file):
+        table_id = table['tableId']
+        if table_filter_set is not None:
+            if table_id not in table_filter_set:
+                continue
+        table_lst.append(table)
     return table_lst
 
 def read_table_filter_set(table_fileter_file):
@@ -45,18 +46,20 @@ def init_worker():
     global g_tokenizer
     g_tokenizer = transformers.BertTokenizerFast.from_pretrained('bert-base-uncased')
 
-def is_good_col_name(col_name):
+def is_good_col_name(col_name, col_token_size):
     MAX_COL_NAME_SIZE = 20
     if col_name == '':
         return False
-    col_token_size = get_text_size(col_name)
     if col_token_size > MAX_COL_NAME_SIZE:
         return False
     return True
 
-def get_outlier(data):
-    Q1 = np.percentile(data, 25)
-    Q3 = np.percentile(data, 75)
+def get_outlier(size_hist):
+    # None if there are no sizes
+    Q1 = get_hist_percentile(size_hist, 25)
+    if Q1 is None:
+        return None
+    Q3 = get_hist_percentile(size_hist, 75)
     IQR = Q3 - Q1
     lower = 1 # Q1 - 1.5 * IQR
     if lower <= 0:
@@ -64,58 +67,239 @@ def get_outlier(data):
     upper = Q3 + 1.5 * IQR
     return (lower, upper)
 
-def stat_tables(table_lst):
-    col_name_size_lst = []
-    cell_size_lst = []
-    for table in tqdm(table_lst):
-        columns = table['columns']
-        table_col_size_lst = [get_text_size(a['text']) for a in columns]
-        col_name_size_lst.extend(table_col_size_lst)
-        row_info_lst = table['rows']
-        for row_info in row_info_lst:
-            cell_lst = row_info['cells']
-            row_cell_size_lst = [get_text_size(a['text']) for a in cell_lst]
-            cell_size_lst.extend(row_cell_size_lst)
-    
-    col_name_outlier = get_outlier(col_name_size_lst)
-    cell_outlier = get_outlier(cell_size_lst)
+# Token sizes are small integers, so a histogram (count of every size) summarizes them exactly in memory
+# bounded by the largest size, and histograms of workers are merged by adding them.
+# get_hist_percentile gives the same value as np.percentile (linear interpolation) on all the sizes.
+
+def get_size_hist(size_lst):
+    return np.bincount(np.asarray(size_lst, dtype=np.int64)).astype(np.int64)
+
+def merge_size_hist(hist_1, hist_2):
+    if len(hist_1) < len(hist_2):
+        hist_1, hist_2 = hist_2, hist_1
+    out_hist = hist_1.copy()
+    out_hist[:len(hist_2)] += hist_2
+    return out_hist
+
+def get_hist_percentile(size_hist, q):
+    # None for an empty histogram
+    cum_counts = np.cumsum(size_hist)
+    if len(cum_counts) == 0 or cum_counts[-1] == 0:
+        return None
+    N = int(cum_counts[-1])
+    pos = (q / 100) * (N - 1)
+    idx_lo = int(np.floor(pos))
+    idx_hi = min(idx_lo + 1, N - 1)
+    t = pos - idx_lo
+    # the size at sorted index i is the first size whose cumulative count exceeds i
+    a = float(np.searchsorted(cum_counts, idx_lo, side='right'))
+    b = float(np.searchsorted(cum_counts, idx_hi, side='right'))
+    # the same interpolation as numpy
+    if t >= 0.5:
+        return b - (b - a) * (1 - t)
+    return a + (b - a) * t
+
+def get_stat_info(table_profiles):
+    col_name_outlier = get_outlier(table_profiles.col_name_hist)
+    cell_outlier = get_outlier(table_profiles.cell_hist)
     table_stat_info = {
         'col_name_outlier':col_name_outlier,
         'cell_outlier':cell_outlier
     }
     return table_stat_info
 
-def get_text_size(text):
-    tokens = g_tokenizer.tokenize(text)
-    return len(tokens)
-
-def get_col_entities(table):
-    col_entity_lst = []
-    column_data = table['columns']
-    row_data = table['rows']
-    for col_idx, col_info in enumerate(column_data):
-        col_name = col_info['text'].strip()
-        ent_info_lst = []
-        for row_idx, row_info in enumerate(row_data):
-            ent_text = row_info['cells'][col_idx]['text'].strip()
-            ent_size = get_text_size(ent_text)
-            ent_info = {'text':ent_text, 'size':ent_size, 'row':row_idx}
-            ent_info_lst.append(ent_info)
-
-        col_entity_info = {
-            'col_name':col_name,
-            'entities':ent_info_lst
+def profile_tables(table_lst, num_workers=1):
+    # workers tokenize tables in batches and return the table profiles and size histograms, merged here
+    col_name_hist = np.zeros(1, dtype=np.int64)
+    cell_hist = np.zeros(1, dtype=np.int64)
+    profile_lst = []
+
+    t1 = time.time()
+    batch_itr = get_stat_batches(table_lst)
+    pbar = tqdm(desc='profile tables', total=len(table_lst))
+    if num_workers > 1:
+        work_pool = ProcessPool(num_workers, initializer=init_worker)
+        # imap reads all its input at once, so batches are given a group at a time
+        stat_itr = (stat_info for batch_group in table_store.batch_tables(batch_itr, num_workers * 4)
+                    for stat_info in work_pool.imap(stat_table_batch, batch_group))
+    else:
+        work_pool = None
+        if g_tokenizer is None:
+            init_worker()
+        stat_itr = map(stat_table_batch, batch_itr)
+    for batch_col_name_hist, batch_cell_hist, batch_profile_lst in stat_itr:
+        col_name_hist = merge_size_hist(col_name_hist, batch_col_name_hist)
+        cell_hist = merge_size_hist(cell_hist, batch_cell_hist)
+        profile_lst.extend(batch_profile_lst)
+        pbar.update(len(batch_profile_lst))
+    pbar.close()
+    if work_pool is not None:
+        work_pool.close()
+        work_pool.join()
+    t2 = time.time()
+    num_col_names = int(col_name_hist.sum())
+    num_cells = int(cell_hist.sum())
+    print('%d column names, %d cells, %.1f cells/sec' % (num_col_names, num_cells, num_cells / max(t2 - t1, 1e-9)))
+    return TableProfiles.from_profiles(profile_lst, col_name_hist, cell_hist)
+
+def get_stat_batches(table_lst, max_batch_cells=20000):
+    batch = []
+    batch_cells = 0
+    for table in table_lst:
+        batch.append(table)
+        batch_cells += len(table['columns']) + sum([len(a['cells']) for a in table['rows']])
+        if batch_cells >= max_batch_cells:
+            yield batch
+            batch = []
+            batch_cells = 0
+    if len(batch) > 0:
+        yield batch
+
+def stat_table_batch(table_batch):
+    col_name_lst = []
+    cell_lst = []
+    for table in table_batch:
+        col_name_lst.extend([a['text'] for a in table['columns']])
+        for row_info in table['rows']:
+            cell_lst.extend([a['text'] for a in row_info['cells']])
+    col_name_sizes = get_text_sizes(col_name_lst)
+    cell_sizes = get_text_sizes(cell_lst)
+    profile_lst = []
+    col_pos = 0
+    cell_pos = 0
+    for table in table_batch:
+        num_cols = len(table['columns'])
+        profile = get_table_profile(table, col_name_sizes[col_pos:(col_pos + num_cols)], cell_sizes, cell_pos)
+        profile_lst.append(profile)
+        col_pos += num_cols
+        cell_pos += sum([len(a['cells']) for a in table['rows']])
+    return (get_size_hist(col_name_sizes), get_size_hist(cell_sizes), profile_lst)
+
+def get_text_sizes(text_lst):
+    # token sizes with the batch API of the fast tokenizer
+    if len(text_lst) == 0:
+        return np.zeros(0, dtype=np.int32)
+    encoded = g_tokenizer(text_lst, add_special_tokens=False, return_attention_mask=False,
+                          return_token_type_ids=False)
+    return np.array([len(a) for a in encoded['input_ids']], dtype=np.int32)
+
+# A table profile keeps only per column counters, so the profiles of a collection take memory by columns,
+# not by cells. good_col and float_col are is_good_col_name and the inferred type, min_cell_size is the token
+# size of the smallest cell that is not empty (NO_CELL_SIZE if there is none), which tells whether a column
+# has a condition cell once the outlier bound is known. The token size of a cell is the same with and without
+# surrounding spaces.
+
+NO_CELL_SIZE = np.iinfo(np.int32).max
+
+def get_table_profile(table, col_name_sizes, cell_sizes, cell_pos):
+    # cell_sizes has the sizes of all the cells of the batch, those of this table start at cell_pos
+    col_name_lst = [a['text'].strip() for a in table['columns']]
+    num_cols = len(col_name_lst)
+    num_rows = len(table['rows'])
+    good_col = np.array([is_good_col_name(col_name, col_name_sizes[col])
+                        for col, col_name in enumerate(col_name_lst)], dtype=bool)
+    min_cell_size = np.full(num_cols, NO_CELL_SIZE, dtype=np.int32)
+    # a row with missing cells is padded with empty ones, which are not float
+    float_col = np.full(num_cols, True, dtype=bool)
+    for row_info in table['rows']:
+        cell_data = row_info['cells'][:num_cols]
+        float_col[len(cell_data):] = False
+        for col, cell_info in enumerate(cell_data):
+            cell_text = cell_info['text'].strip()
+            if cell_text != '':
+                min_cell_size[col] = min(min_cell_size[col], cell_sizes[cell_pos + col])
+            if float_col[col] and (not is_float(cell_text)):
+                float_col[col] = False
+        cell_pos += len(row_info['cells'])
+    profile = {
+        'table_id':table['tableId'],
+        'num_cols':num_cols,
+        'good_col':good_col,
+        'float_col':float_col,
+        'min_cell_size':min_cell_size
+    }
+    return profile
+
+PROFILE_VERSION = 2
+
+def get_profile_file(table_file):
+    return table_file + '_profiles.npz'
+
+class TableProfiles:
+    # Profiles of a table collection in flat arrays, saved next to the table file and reused while the table
+    # file is unchanged. get(table_id) gives the profile of a table as views of the arrays.
+    ARRAY_LST = ['num_cols', 'good_col', 'float_col', 'min_cell_size', 'col_name_hist', 'cell_hist']
+
+    def __init__(self, table_id_lst, array_dict):
+        self.table_id_lst = table_id_lst
+        for name in TableProfiles.ARRAY_LST:
+            setattr(self, name, array_dict[name])
+        self.col_offsets = np.concatenate([[0], np.cumsum(self.num_cols, dtype=np.int64)])
+        self.table_idx_dict = {table_id:idx for idx, table_id in enumerate(table_id_lst)}
+
+    @staticmethod
+    def from_profiles(profile_lst, col_name_hist, cell_hist):
+        def concat(name, dtype):
+            return np.concatenate([np.zeros(0, dtype=dtype)] + [a[name] for a in profile_lst]).astype(dtype)
+        array_dict = {
+            'num_cols':np.array([a['num_cols'] for a in profile_lst], dtype=np.int32),
+            'good_col':concat('good_col', bool),
+            'float_col':concat('float_col', bool),
+            'min_cell_size':concat('min_cell_size', np.int32),
+            'col_name_hist':col_name_hist,
+            'cell_hist':cell_hist
         }
-        col_entity_lst.append(col_entity_info)
-    return col_entity_lst
+        return TableProfiles([a['table_id'] for a in profile_lst], array_dict)
+
+    def __len__(self):
+        return len(self.table_id_lst)
+
+    def __contains__(self, table_id):
+        return table_id in self.table_idx_dict
+
+    def get(self, table_id):
+        idx = self.table_idx_dict[table_id]
+        col_start, col_end = self.col_offsets[idx], self.col_offsets[idx + 1]
+        profile = {
+            'good_cols':np.flatnonzero(self.good_col[col_start:col_end]).tolist(),
+            'float_col':self.float_col[col_start:col_end],
+            'min_cell_size':self.min_cell_size[col_start:col_end]
+        }
+        return profile
+
+    def save(self, out_file, source_stat):
+        array_dict = {name:getattr(self, name) for name in TableProfiles.ARRAY_LST}
+        array_dict['table_id'] = np.array(self.table_id_lst, dtype=str)
+        array_dict['source'] = np.array([PROFILE_VERSION, source_stat.st_size, source_stat.st_mtime_ns], dtype=np.int64)
+        tmp_file = out_file + '.tmp'
+        with open(tmp_file, 'wb') as f_o:
+            np.savez(f_o, **array_dict)
+        os.replace(tmp_file, out_file)
 
-def get_good_cols(table):
-    col_ent_data = get_col_entities(table)
-    good_cols = []
-    for col, col_info in enumerate(col_ent_data):
-        if is_good_col_name(col_info['col_name']):
-            good_cols.append(col)
-    return (col_ent_data, good_cols) 
+    @staticmethod
+    def load(profile_file, source_stat):
+        # None if the profiles are not of this version of the table file
+        if not os.path.exists(profile_file):
+            return None
+        with np.load(profile_file) as profile_data:
+            source = profile_data['source'].tolist()
+            if source != [PROFILE_VERSION, source_stat.st_size, source_stat.st_mtime_ns]:
+                return None
+            array_dict = {name:profile_data[name] for name in TableProfiles.ARRAY_LST}
+            table_id_lst = profile_data['table_id'].tolist()
+        return TableProfiles(table_id_lst, array_dict)
+
+def load_table_profiles(table_file, table_lst, num_workers=1):
+    # table_lst has all the tables of table_file, they are profiled only when table_file has changed
+    source_stat = os.stat(table_file)
+    profile_file = get_profile_file(table_file)
+    table_profiles = TableProfiles.load(profile_file, source_stat)
+    if table_profiles is not None:
+        print('table profiles loaded from %s' % profile_file)
+        return table_profiles
+    table_profiles = profile_tables(table_lst, num_workers=num_workers)
+    table_profiles.save(profile_file, source_stat)
+    return table_profiles
 
 def is_float(text):
     if text == '':
@@ -124,94 +308,227 @@ def is_float(text):
         return False
     return True
 
-def infer_column_type(col_ent_data):
-    for col_info in col_ent_data:
-        entities = col_info['entities']  
-        ent_text_lst = [a['text'] for a in entities] 
-        float_flag_lst = [is_float(a) for a in ent_text_lst] 
-        col_type = 'float' if all(float_flag_lst) else 'text'
-        col_info['type_infered'] = col_type 
-
-def get_query_table(table_id, col_ent_data):
-    col_name_lst = [a['col_name'] for a in col_ent_data]
+def get_query_table(table):
+    col_name_lst = [a['text'].strip() for a in table['columns']]
     query_table = {
-        'id':table_id,
+        'id':table['tableId'],
         'header':col_name_lst
     }
     return query_table
 
-def generate_queries(sql_dir, mode, table_lst, num_queries, stat_info, sql_dict):
+# Query sampling draws only from what can make a query, so no try is rejected except for a duplicate sql.
+# A table is eligible if it has a good column and a title or a row with a condition cell, a good column cell
+# that is not empty and not oversize with another good column left for select. The number of conditions
+# (0 is the title only) is drawn from the ones the table allows, the row from the rows with a condition cell
+# and the condition columns from the condition cells of the row. Eligibility only needs the column counters
+# of the profile, the condition cells of a table are found when it is sampled and kept for the last
+# MAX_CACHED_TABLES tables sampled.
+
+MAX_DUP_TRIES = 10000
+MAX_CACHED_TABLES = 1000
+
+def get_table_query_index(table, profile, outlier_upper):
+    good_cols = profile['good_cols']
+    if len(good_cols) == 0:
+        return None
+    has_title = (table['documentTitle'].strip() != '')
+    # the good columns with a condition cell
+    cond_cols = []
+    if len(good_cols) > 1:
+        cond_cols = [a for a in good_cols if profile['min_cell_size'][a] <= outlier_upper]
+    cond_col_num_lst = [] # the sql cond will also include the title as ('about', =, Title)
+    if has_title:
+        cond_col_num_lst.append(0)
+    if len(cond_cols) > 0:
+        cond_col_num_lst.extend([1, 2, 3])
+    if len(cond_col_num_lst) == 0:
+        return None
+    query_index = {
+        'good_cols':good_cols,
+        'float_col':profile['float_col'],
+        'cond_cols':cond_cols,
+        'cond_col_num_lst':cond_col_num_lst,
+        'outlier_upper':outlier_upper
+    }
+    return query_index
+
+def get_cond_cells(table, query_index):
+    # cond_mask is by row and good column, cond_rows are the rows with a condition cell
+    good_cols = query_index['good_cols']
+    cond_col_set = set(query_index['cond_cols'])
+    cell_pos_lst = []
+    text_lst = []
+    for row, row_info in enumerate(table['rows']):
+        cell_data = row_info['cells'][:len(query_index['float_col'])]
+        for good_col_idx, col in enumerate(good_cols):
+            if (col in cond_col_set) and (col < len(cell_data)) and (cell_data[col]['text'].strip() != ''):
+                cell_pos_lst.append((row, good_col_idx))
+                text_lst.append(cell_data[col]['text'])
+    cond_mask = np.zeros((len(table['rows']), len(good_cols)), dtype=bool)
+    for (row, good_col_idx), cell_size in zip(cell_pos_lst, get_text_sizes(text_lst)):
+        cond_mask[row, good_col_idx] = (cell_size <= query_index['outlier_upper'])
+    cond_rows = np.flatnonzero(cond_mask.any(axis=1)).tolist()
+    return (cond_mask, cond_rows)
+
+class QuerySampler:
+    def __init__(self, table_lst, table_profiles, stat_info):
+        # a collection without cells has no condition cells
+        cell_outlier = stat_info['cell_outlier']
+        outlier_upper = cell_outlier[1] if cell_outlier is not None else -1
+        self.table_lst = []
+        self.query_index_lst = []
+        for table in table_lst:
+            query_index = get_table_query_index(table, table_profiles.get(table['tableId']), outlier_upper)
+            if query_index is not None:
+                self.table_lst.append(table)
+                self.query_index_lst.append(query_index)
+        self.cond_cell_cache = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.table_lst)
+
+    def get_cond_cells(self, idx):
+        if idx in self.cond_cell_cache:
+            self.cond_cell_cache.move_to_end(idx)
+            return self.cond_cell_cache[idx]
+        cond_cells = get_cond_cells(self.table_lst[idx], self.query_index_lst[idx])
+        self.cond_cell_cache[idx] = cond_cells
+        if len(self.cond_cell_cache) > MAX_CACHED_TABLES:
+            self.cond_cell_cache.popitem(last=False)
+        return cond_cells
+
+    def sample(self, rng):
+        idx = rng.randrange(len(self.table_lst))
+        table = self.table_lst[idx]
+        query_index = self.query_index_lst[idx]
+        cond_cells = None
+        if len(query_index['cond_cols']) > 0:
+            cond_cells = self.get_cond_cells(idx)
+        return (table, sample_query(table, query_index, cond_cells, rng))
+
+# Queries are sampled in batches of QUERY_BATCH_SIZE by worker processes. Batch batch_no has its own random
+# generator seeded from (seed, batch_no), and the batches are consumed in order, so the queries only depend on
+# the seed, not on the number of workers. Workers also hash the sql, sql_dict keeps the 8 byte blake2b of the
+# lowercased sql text of every query generated, which the coordinator checks for duplicates.
+
+QUERY_BATCH_SIZE = 1000
+
+g_query_sampler = None
+
+def init_query_worker(query_sampler):
+    global g_query_sampler
+    g_query_sampler = query_sampler
+    # condition cells are tokenized when a table is sampled
+    if g_tokenizer is None:
+        init_worker()
+
+def get_sql_key(sql_text):
+    return hashlib.blake2b(sql_text.lower().encode('utf-8'), digest_size=8).digest()
+
+def get_batch_seed(seed, batch_no):
+    seed_text = '%d_%d' % (seed, batch_no)
+    return int.from_bytes(hashlib.blake2b(seed_text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def sample_query_batch(batch_info):
+    seed, batch_no = batch_info
+    rng = random.Random(get_batch_seed(seed, batch_no))
     query_lst = []
-    max_try_count = int(1E9)
-    if num_queries > max_try_count:
-        raise ValueError('The %s query size %d must be less than %d ' % (mode, num_queries, max_try_count))
-    try_count = 0
+    for _ in range(QUERY_BATCH_SIZE):
+        table, query = g_query_sampler.sample(rng)
+        query_table = get_query_table(table)
+        sql_text = get_sql_text(query_table, query['sql'])
+        query['sql_text'] = sql_text
+        query_lst.append((get_sql_key(sql_text), query))
+    return query_lst
+
+def get_mode_seed(seed, mode):
+    # the dev split and every train round get their own seed from the configured one, None stays random
+    if seed is None:
+        return None
+    seed_text = '%d_%s' % (seed, mode)
+    return int.from_bytes(hashlib.blake2b(seed_text.encode('utf-8'), digest_size=8).digest(), 'little') >> 1
+
+def generate_queries(sql_dir, mode, table_lst, num_queries, stat_info, sql_dict, table_profiles=None,
+                     num_workers=1, seed=None):
+    # table_profiles (from load_table_profiles) has the profiles of table_lst, they are computed here if not given
+    if table_profiles is None:
+        table_profiles = profile_tables(table_lst)
+    if seed is None:
+        seed = random.getrandbits(63)
+    query_sampler = QuerySampler(table_lst, table_profiles, stat_info)
+    query_lst = []
+    if len(query_sampler) == 0:
+        print('No %s table can have queries' % mode)
+    if num_workers > 1:
+        work_pool = ProcessPool(num_workers, initializer=init_query_worker, initargs=(query_sampler,))
+    else:
+        work_pool = None
+        init_query_worker(query_sampler)
+    # only duplicates are retried, a run of MAX_DUP_TRIES of them means the tables have (almost) no more queries
+    dup_count = 0
+    batch_no = 0
     task_desc = '%s sqls' % mode
     pbar = tqdm(desc=task_desc, total=num_queries)
-    progress = 0
-    while (len(query_lst) < num_queries) and (try_count < max_try_count):
-        try_count += 1
-        table = random.sample(table_lst, 1)[0]
-        col_ent_data, good_cols = get_good_cols(table)
-        if len(good_cols) == 0:
-            continue 
-        infer_column_type(col_ent_data)
-        query = sample_query(table, col_ent_data, good_cols, stat_info)
-        if query is not None: 
-            query_table = get_query_table(table['tableId'], col_ent_data)
-            sql_info = query['sql']
-            sql_text = get_sql_text(query_table, sql_info)
-            sql_text_key = sql_text.lower()
-            if sql_text_key not in sql_dict:
-                sql_dict[sql_text_key] = 1 
-                query['sql_text'] = sql_text
+    while (len(query_lst) < num_queries) and (len(query_sampler) > 0) and (dup_count < MAX_DUP_TRIES):
+        num_batches = min(max(num_workers, 1) * 2,
+                          (num_queries - len(query_lst) + QUERY_BATCH_SIZE - 1) // QUERY_BATCH_SIZE)
+        batch_group = [(seed, batch_no + a) for a in range(num_batches)]
+        batch_no += num_batches
+        if work_pool is not None:
+            batch_itr = work_pool.imap(sample_query_batch, batch_group)
+        else:
+            batch_itr = map(sample_query_batch, batch_group)
+        for query_batch in batch_itr:
+            for sql_key, query in query_batch:
+                if (len(query_lst) >= num_queries) or (dup_count >= MAX_DUP_TRIES):
+                    break
+                if sql_key in sql_dict:
+                    dup_count += 1
+                    continue
+                dup_count = 0
+                sql_dict[sql_key] = 1 
                 query_lst.append(query)
-                
-                progress_step = (len(query_lst) - progress)
-                if progress_step > 0: 
-                    pbar.update(progress_step)
-                    progress = len(query_lst)
+                pbar.update(1)
+    pbar.close()
+    if work_pool is not None:
+        work_pool.close()
+        work_pool.join()
+    if len(query_lst) < num_queries:
+        print('%d %s queries generated, %d asked, no more distinct queries' % (len(query_lst), mode, num_queries))
    
     f_o_src, f_o_tar, f_o_meta = create_sql_file(sql_dir)
     write_query(mode, query_lst, f_o_src, f_o_tar, f_o_meta)
 
-def sample_query(table, col_ent_data, col_lst, stat_info):
-    table_id = table['tableId']
-    row_data = table['rows']
-    sel_col = random.sample(col_lst, 1)[0]
-    sel_col_type = col_ent_data[sel_col]['type_infered'] 
-    if sel_col_type == 'float':
-        agg_op = random.sample(SqlQuery.agg_ops[1:], 1)[0] 
+def sample_query(table, query_index, cond_cells, rng):
+    # cond_cells is from get_cond_cells, None if the table has no condition cell
+    good_cols = query_index['good_cols']
+    cond_col_num = rng.sample(query_index['cond_col_num_lst'], 1)[0]
+    cond_col_lst = []
+    row = None
+    if cond_col_num > 0:
+        cond_mask, cond_rows = cond_cells
+        row = rng.sample(cond_rows, 1)[0]
+        row_cond_cols = [good_cols[a] for a in np.flatnonzero(cond_mask[row])]
+        # a good column is left for select
+        num_sample_cond_col = min(cond_col_num, len(row_cond_cols), len(good_cols) - 1)
+        cond_col_lst = rng.sample(row_cond_cols, num_sample_cond_col)
+
+    sel_col = rng.sample([a for a in good_cols if a not in cond_col_lst], 1)[0]
+    if query_index['float_col'][sel_col]:
+        agg_op = rng.sample(SqlQuery.agg_ops[1:], 1)[0] 
     else:
         agg_op = ''
     agg_op_idx = SqlQuery.agg_ops.index(agg_op)
     
-    all_cond_cols = [a for a in col_lst if a != sel_col]
-    cond_col_num_lst = [0, 1, 2, 3] # the sql cond will also include the title as ('about', =, Title)
     cond_op_idx_lst = [a for a in range(len(SqlQuery.cond_ops)-1)] # ignore the last one 'op'
-        
     sql_cond_lst = []
     title = table['documentTitle'].strip()
     if title != '':
         sql_cond = [None, 0, title]
         sql_cond_lst.append(sql_cond)
-    
-    cond_col_num = random.sample(cond_col_num_lst, 1)[0]
-    cond_col_lst = []
-    row = None
-    if cond_col_num > 0:
-        num_sample_cond_col = min(len(all_cond_cols), cond_col_num)
-        cond_col_lst = random.sample(all_cond_cols, num_sample_cond_col)
-        row_spaces = get_sample_row_space(row_data, col_ent_data, cond_col_lst)
-        if len(row_spaces) > 0:
-            row = random.sample(row_spaces, 1)[0]
-            for cond_col in cond_col_lst:
-                sql_cond = get_sql_cond(row, col_ent_data, cond_col, cond_op_idx_lst, stat_info)
-                if sql_cond is not None:
-                    sql_cond_lst.append(sql_cond)
-   
-    if len(sql_cond_lst) == 0:
-        return None
+    for cond_col in cond_col_lst:
+        sql_cond = get_sql_cond(table, row, query_index, cond_col, cond_op_idx_lst, rng)
+        sql_cond_lst.append(sql_cond)
          
     sql_info = {
         'conds':sql_cond_lst,
@@ -222,19 +539,19 @@ def sample_query(table, col_ent_data, col_lst, stat_info):
     query_info = {
         'question':'N/A',
         'sql':sql_info,
-        'table_id':table_id,
+        'table_id':table['tableId'],
         'row':row,
     }
     return query_info
 
-def get_sql_cond(row, col_ent_data, cond_col, cond_op_idx_lst, stat_info):
-    cond_col_type = col_ent_data[cond_col]['type_infered']
-    if cond_col_type == 'float':
-        cond_op_idx = random.sample(cond_op_idx_lst, 1)[0]
+def get_sql_cond(table, row, query_index, cond_col, cond_op_idx_lst, rng):
+    # the cell is a condition cell of the row
+    if query_index['float_col'][cond_col]:
+        cond_op_idx = rng.sample(cond_op_idx_lst, 1)[0]
     else:
         cond_op_idx = 0
     
-    cond_value = col_ent_data[cond_col]['entities'][row]['text'] 
+    cond_value = table['rows'][row]['cells'][cond_col]['text'].strip()
     cond_op = SqlQuery.cond_ops[cond_op_idx]
     if cond_op == '>':
         float_cond_value = float(cond_value)
@@ -254,34 +571,22 @@ def get_sql_cond(row, col_ent_data, cond_col, cond_op_idx_lst, stat_info):
         if float_cond_value == 0:
             float_cond_value = 1 
         cond_value = str(float_cond_value)
-     
-    cond_value_size = col_ent_data[cond_col]['entities'][row]['size']
-    outlier_upper = stat_info['cell_outlier'][1]
-    if cond_value_size > outlier_upper:
-        return None
-         
+
     sql_cond = [int(cond_col), int(cond_op_idx), cond_value]
     return sql_cond 
 
-def get_sample_row_space(row_data, col_ent_data, col_lst):
-    row_spaces = []
-    for row in range(len(row_data)):
-        if not is_row_data_missing(row, col_ent_data, col_lst):
-            row_spaces.append(row)
-    return row_spaces 
-
-def is_row_data_missing(row, col_ent_data, col_lst):
-    for col in col_lst:
-        if col_ent_data[col]['entities'][row] == '':
-            return True
-    return False
+def get_input_table_file(args):
+    input_table_file = os.path.join(args.work_dir, 'data', args.dataset, 'tables', args.table_file)
+    return table_store.resolve_table_file(input_table_file)
 
 def get_train_dev_tables(args):
-    input_table_file = os.path.join(args.work_dir, 'data', args.dataset, 'tables', args.table_file)
+    input_table_file = get_input_table_file(args)
     table_lst = read_tables(input_table_file, None)
     num_tables = len(table_lst)
     num_dev = int(num_tables * args.dev_table_pct)
-    dev_tables = random.sample(table_lst, num_dev)
+    split_seed = get_mode_seed(getattr(args, 'seed', None), 'split')
+    rng = random if split_seed is None else random.Random(split_seed)
+    dev_tables = rng.sample(table_lst, num_dev)
     dev_table_id_set = set([a['tableId'] for a in dev_tables])
     train_tables = [a for a in table_lst if a['tableId'] not in dev_table_id_set] 
     return (table_lst, train_tables, dev_tables)
@@ -331,19 +636,23 @@ def init_data(args):
     write_table_split(train_tables, out_dir, 'train_tables.jsonl')
     write_table_split(dev_tables, out_dir, 'dev_tables.jsonl')
 
-    init_worker()
-    stat_info = stat_tables(all_tables)
+    table_profiles = load_table_profiles(get_input_table_file(args), all_tables,
+                                         num_workers=getattr(args, 'num_workers', 1))
+    stat_info = get_stat_info(table_profiles)
     write_stat_info(stat_info, out_dir, 'stat_info.json') 
     
     dev_sql_dir = os.path.join(out_dir, 'dev')
     sql_dict = {}
-    generate_queries(dev_sql_dir, 'dev', dev_tables, args.num_dev_queries, stat_info, sql_dict)
+    generate_queries(dev_sql_dir, 'dev', dev_tables, args.num_dev_queries, stat_info, sql_dict,
+                     table_profiles=table_profiles, num_workers=getattr(args, 'num_workers', 1),
+                     seed=get_mode_seed(getattr(args, 'seed', None), 'dev'))
     msg_info = {
         'state':True,
         'sql_data_dir':out_dir,
         'sql_dict':sql_dict,
         'train_tables':train_tables,
-        'stat_info':stat_info
+        'stat_info':stat_info,
+        'table_profiles':table_profiles
     }
     return msg_info
 
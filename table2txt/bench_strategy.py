@@ -0,0 +1,174 @@
+import json
+import time
+import random
+import argparse
+import tracemalloc
+import table_store
+from table2txt.graph_strategy.strategy_constructor import get_strategy, STRATEGY_NAME_LST
+
+# Cost of the linearization strategies on a sample of tables.
+# A strategy is given as a name from STRATEGY_NAME_LST, with ':pack_size' for packing, e.g. RelationGraph:150.
+# Every strategy runs twice on its own copy of the sample, once timed and once with tracemalloc for the peak
+# memory. Encoding time of the whole collection is projected from the passage count and length, an encoder
+# doing --encode_rate passages/sec at --passage_maxlength tokens and time linear in the (truncated) length.
+
+def sample_tables(table_file, num_tables, seed):
+    # reservoir sample, the tables are read once
+    rng = random.Random(seed)
+    table_lst = []
+    num_total = 0
+    for table in table_store.iter_tables(table_file):
+        num_total += 1
+        if len(table_lst) < num_tables:
+            table_lst.append(table)
+        else:
+            idx = rng.randint(0, num_total - 1)
+            if idx < num_tables:
+                table_lst[idx] = table
+    return table_lst, num_total
+
+def parse_strategy(strategy_spec):
+    if ':' in strategy_spec:
+        name, pack_size = strategy_spec.split(':')
+        return name, int(pack_size)
+    return strategy_spec, 0
+
+def copy_tables(table_lst):
+    # strategies change the tables in place, CompleteGraph and GraphNoCaption need documentUrl
+    table_copy_lst = json.loads(json.dumps(table_lst))
+    for table in table_copy_lst:
+        table.setdefault('documentUrl', '')
+    return table_copy_lst
+
+def get_passage_texts(name, strategy, table):
+    if name == 'SlidingStrategy':
+        title = table['documentTitle'].strip()
+        col_info_lst = [{'text':a['text'].strip()} for a in table['columns']]
+        text_lst = []
+        for row_item in table['rows']:
+            strategy.reset()
+            text_lst.extend([a['text'] for a in strategy.get_text(title, col_info_lst, row_item)])
+        return text_lst
+    graph_lst = strategy.generate(table)
+    if isinstance(graph_lst, tuple):
+        # CompleteGraph and GraphNoCaption return (table, graph_lst)
+        graph_lst = graph_lst[1]
+    return [a['graph'] for a in graph_lst]
+
+def get_tokenizer(bert_tokens):
+    if not bert_tokens:
+        return lambda text: len(text.split())
+    try:
+        import transformers
+    except ImportError:
+        raise ImportError('transformers is needed for --bert_tokens 1, install it by "pip install transformers"')
+    tokenizer = transformers.BertTokenizerFast.from_pretrained('bert-base-uncased')
+    return lambda text: len(tokenizer.tokenize(text))
+
+def run_strategy(name, pack_size, table_lst, count_tokens, passage_maxlength):
+    strategy = get_strategy(name, pack_size=pack_size)
+    num_passages = 0
+    num_tokens = 0
+    num_truncated = 0
+    encode_units = 0
+    gen_time = 0
+    for table in copy_tables(table_lst):
+        t1 = time.time()
+        text_lst = get_passage_texts(name, strategy, table)
+        gen_time += time.time() - t1
+        num_passages += len(text_lst)
+        for text in text_lst:
+            token_size = count_tokens(text)
+            num_tokens += token_size
+            num_truncated += int(token_size > passage_maxlength)
+            encode_units += min(token_size, passage_maxlength) / passage_maxlength
+
+    table_copy_lst = copy_tables(table_lst)
+    tracemalloc.start()
+    for table in table_copy_lst:
+        get_passage_texts(name, strategy, table)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stat_info = {
+        'num_passages':num_passages,
+        'num_tokens':num_tokens,
+        'num_truncated':num_truncated,
+        'encode_units':encode_units,
+        'gen_time':gen_time,
+        'peak_memory':peak_memory
+    }
+    return stat_info
+
+def get_result(strategy_spec, stat_info, num_sample, num_total, args):
+    num_passages = stat_info['num_passages']
+    scale = num_total / max(num_sample, 1)
+    result = {
+        'strategy':strategy_spec,
+        'tables':num_sample,
+        'passages_per_table':num_passages / max(num_sample, 1),
+        'tokens_per_passage':stat_info['num_tokens'] / max(num_passages, 1),
+        'truncated_pct':100 * stat_info['num_truncated'] / max(num_passages, 1),
+        'tables_per_sec':num_sample / max(stat_info['gen_time'], 1e-9),
+        'peak_memory_mb':stat_info['peak_memory'] / (1024 * 1024),
+        'total_passages':num_passages * scale,
+        'encode_hours':stat_info['encode_units'] * scale / args.encode_rate / 3600
+    }
+    return result
+
+def show_results(result_lst, num_total):
+    print('projected to %d tables' % num_total)
+    print('%-22s %10s %10s %8s %10s %10s %14s %10s' % ('strategy', 'psg/table', 'tok/psg', 'trunc%', 'tables/s',
+          'peak(MB)', 'total psg', 'encode(h)'))
+    for result in result_lst:
+        print('%-22s %10.1f %10.1f %8.1f %10.1f %10.2f %14d %10.2f' % (result['strategy'],
+              result['passages_per_table'], result['tokens_per_passage'], result['truncated_pct'],
+              result['tables_per_sec'], result['peak_memory_mb'], result['total_passages'], result['encode_hours']))
+
+def main(args):
+    if args.table_file is not None:
+        table_file = table_store.resolve_table_file(args.table_file)
+    else:
+        table_file = table_store.get_table_file(args.work_dir, args.dataset)
+    for strategy_spec in args.strategies:
+        name, _ = parse_strategy(strategy_spec)
+        if name not in STRATEGY_NAME_LST:
+            print('Stategy (%s) Not supported, choose from %s' % (name, ', '.join(STRATEGY_NAME_LST)))
+            return
+    table_lst, num_total = sample_tables(table_file, args.num_tables, args.seed)
+    if args.num_total_tables > 0:
+        num_total = args.num_total_tables
+    count_tokens = get_tokenizer(args.bert_tokens)
+
+    result_lst = []
+    for strategy_spec in args.strategies:
+        name, pack_size = parse_strategy(strategy_spec)
+        print('benchmarking %s' % strategy_spec)
+        stat_info = run_strategy(name, pack_size, table_lst, count_tokens, args.passage_maxlength)
+        result_lst.append(get_result(strategy_spec, stat_info, len(table_lst), num_total, args))
+    show_results(result_lst, num_total)
+    if args.out_file is not None:
+        with open(args.out_file, 'w') as f_o:
+            for result in result_lst:
+                f_o.write(json.dumps(result) + '\n')
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--work_dir', type=str)
+    parser.add_argument('--dataset', type=str)
+    parser.add_argument('--table_file', type=str)
+    parser.add_argument('--strategies', type=str, nargs='+', default=['RelationGraph', 'RelationGraph:150',
+                        'KeyColumnGraph', 'CompleteGraph', 'GraphNoCaption'])
+    parser.add_argument('--num_tables', type=int, default=1000)
+    parser.add_argument('--num_total_tables', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bert_tokens', type=int, default=0)
+    parser.add_argument('--passage_maxlength', type=int, default=200)
+    parser.add_argument('--encode_rate', type=float, default=1000)
+    parser.add_argument('--out_file', type=str)
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    args = get_args()
+    main(args)
@@ -0,0 +1,164 @@
+import json
+import os
+import hashlib
+import bisect
+from collections import deque
+import table_store
+
+# State of incremental linearization, kept next to passages.jsonl.
+# passages.jsonl_state.json has, for every table linearized, the content hash and the p_id range of its
+# passages, so the next run only linearizes tables that are new or changed and appends them after the last
+# p_id. Passages of changed or removed tables stay in passages.jsonl but are retired, their ranges are
+# appended to passages.jsonl_retired.jsonl with the run number.
+# The sample records and the postings of retired tables are dropped from their files at the end of the run.
+# index_tables --incremental encodes the shards of the appended passages only, and drops the embeddings of
+# the retired passages before the index is rebuilt, so retrieval never sees them.
+
+# options that change the passages of a table, a run with other values can not be incremental
+STATE_ARG_LST = ['strategy', 'max_table_rows', 'row_seed', 'pack_size', 'compress', 'dedup_passages']
+
+def get_state_file(passage_file):
+    return passage_file + '_state.json'
+
+def get_retired_file(passage_file):
+    return passage_file + '_retired.jsonl'
+
+def get_state_args(args):
+    state_args = {a:getattr(args, a, 0) for a in STATE_ARG_LST}
+    state_args['compress'] = getattr(args, 'compress', '')
+    return state_args
+
+def read_state(passage_file):
+    state_file = get_state_file(passage_file)
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file) as f:
+        state = json.load(f)
+    return state
+
+def write_state(state, passage_file):
+    state_file = get_state_file(passage_file)
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as f_o:
+        f_o.write(json.dumps(state))
+    os.replace(tmp_file, state_file)
+
+def get_table_hash(table):
+    table_text = json.dumps(table, sort_keys=True)
+    return hashlib.sha1(table_text.encode('utf-8')).hexdigest()
+
+class TableDiff:
+    # Compares the tables of this run with the state of the previous run
+    def __init__(self, state, args):
+        if state is None:
+            state = {
+                'args':get_state_args(args),
+                'run':0,
+                'num_passages':0,
+                'tables':{}
+            }
+        self.state = state
+        self.prev_table_dict = state['tables']
+        self.table_dict = {}
+        self.pending_lst = deque()
+        self.retired_lst = []
+        # parent tableIds of the changed and removed tables, their sample records and postings are dropped
+        self.retired_table_set = set()
+        self.run = state['run'] + 1
+        self.num_new = 0
+        self.num_changed = 0
+        self.num_unchanged = 0
+
+    def is_updated(self, table):
+        # True if the table needs to be linearized in this run
+        return self.is_group_updated([table])
+
+    def is_group_updated(self, table_lst):
+        # the chunks of a table linearized together (with a row budget) are all linearized again if one changed
+        hash_lst = [get_table_hash(a) for a in table_lst]
+        prev_info_lst = [self.prev_table_dict.get(a['tableId'], None) for a in table_lst]
+        if all([(b is not None) and (b['hash'] == a) for a, b in zip(hash_lst, prev_info_lst)]):
+            for table, prev_info in zip(table_lst, prev_info_lst):
+                self.table_dict[table['tableId']] = prev_info
+            self.num_unchanged += len(table_lst)
+            return False
+        for table, table_hash, prev_info in zip(table_lst, hash_lst, prev_info_lst):
+            table_id = table['tableId']
+            if prev_info is None:
+                self.num_new += 1
+            else:
+                self.num_changed += 1
+                self.retire(table_id, prev_info)
+            self.pending_lst.append((table_id, table_hash, table_store.get_parent_table_id(table)))
+        return True
+
+    def retire(self, table_id, table_info):
+        self.retired_table_set.add(table_info.get('parent_table_id', table_id))
+        if table_info['num_passages'] == 0:
+            return
+        retired_info = {
+            'run':self.run,
+            'table_id':table_id,
+            'start_p_id':table_info['start_p_id'],
+            'num_passages':table_info['num_passages']
+        }
+        self.retired_lst.append(retired_info)
+
+    def add_passages(self, start_p_id, num_passages):
+        # tables are written in the order they are checked
+        table_id, table_hash, parent_table_id = self.pending_lst.popleft()
+        self.table_dict[table_id] = {
+            'hash':table_hash,
+            'start_p_id':start_p_id,
+            'num_passages':num_passages
+        }
+        if parent_table_id != table_id:
+            self.table_dict[table_id]['parent_table_id'] = parent_table_id
+
+    def close(self, passage_file, num_passages):
+        removed_lst = [a for a in self.prev_table_dict if a not in self.table_dict]
+        for table_id in removed_lst:
+            self.retire(table_id, self.prev_table_dict[table_id])
+        with open(get_retired_file(passage_file), 'a') as f_o:
+            for retired_info in self.retired_lst:
+                f_o.write(json.dumps(retired_info) + '\n')
+        self.state['run'] = self.run
+        self.state['num_passages'] = num_passages
+        self.state['tables'] = self.table_dict
+        write_state(self.state, passage_file)
+        return removed_lst
+
+def read_retired_ranges(passage_file):
+    # sorted (start_p_id, num_passages) of the passages no longer in the collection, over all runs
+    range_lst = []
+    retired_file = get_retired_file(passage_file)
+    if not os.path.exists(retired_file):
+        return range_lst
+    with open(retired_file) as f:
+        for line in f:
+            item = json.loads(line)
+            range_lst.append((item['start_p_id'], item['num_passages']))
+    range_lst.sort()
+    return range_lst
+
+def is_retired(range_lst, p_id):
+    idx = bisect.bisect_right(range_lst, (p_id, float('inf'))) - 1
+    return (idx >= 0) and (p_id < range_lst[idx][0] + range_lst[idx][1])
+
+def count_lines(data_file):
+    if not os.path.exists(data_file):
+        return 0
+    with open(data_file) as f:
+        return sum(1 for _ in f)
+
+def retire_lines(data_file, num_old_lines, retired_table_set, get_table_id):
+    # drops the lines written before this run that belong to a retired table, the lines of this run are kept
+    if (num_old_lines == 0) or (len(retired_table_set) == 0):
+        return
+    tmp_file = data_file + '.tmp'
+    with open(data_file) as f, open(tmp_file, 'w') as f_o:
+        for line_no, line in enumerate(f):
+            if (line_no < num_old_lines) and (get_table_id(json.loads(line)) in retired_table_set):
+                continue
+            f_o.write(line)
+    os.replace(tmp_file, data_file)
@@ -0,0 +1,79 @@
+import re
+from table2txt.graph_strategy.rel_graph import RelationGraph
+from table2txt.graph_strategy.rel_tags import RelationTag
+
+# Column pairs are limited to (key column, other column), so the passages of a row grow linearly with the
+# number of columns instead of quadratically. Key (subject) columns are text columns whose values are
+# mostly filled and mostly distinct, e.g. names or titles.
+
+MAX_KEY_COLS = 2
+MIN_UNIQUE_RATIO = 0.8
+MIN_FILL_RATIO = 0.5
+MIN_TEXT_RATIO = 0.5
+MAX_SAMPLE_ROWS = 1000
+
+def is_number(text):
+    return re.match(r'^[-+]?[\d,]*\.?\d+%?$', text) is not None
+
+def get_col_score(table, col_idx, row_idx_lst):
+    # (uniqueness, is_key) of a column over the sampled rows
+    text_lst = [table['rows'][row_idx]['cells'][col_idx]['text'].strip() for row_idx in row_idx_lst]
+    if len(text_lst) == 0:
+        return (0, False)
+    value_lst = [a.lower() for a in text_lst if a != '']
+    fill_ratio = len(value_lst) / len(text_lst)
+    if len(value_lst) == 0:
+        return (0, False)
+    unique_ratio = len(set(value_lst)) / len(text_lst)
+    text_ratio = len([a for a in value_lst if not is_number(a)]) / len(value_lst)
+    is_key = (fill_ratio >= MIN_FILL_RATIO) and (unique_ratio >= MIN_UNIQUE_RATIO) and (text_ratio >= MIN_TEXT_RATIO)
+    return (unique_ratio * text_ratio, is_key)
+
+def get_key_cols(table):
+    N = len(table['columns'])
+    if N == 0:
+        return []
+    row_idx_lst = list(range(min(len(table['rows']), MAX_SAMPLE_ROWS)))
+    score_lst = [get_col_score(table, col_idx, row_idx_lst) for col_idx in range(N)]
+    key_col_lst = [col_idx for col_idx in range(N) if score_lst[col_idx][1]]
+    if len(key_col_lst) == 0:
+        # no column passes the thresholds, the best scoring (leftmost on ties) is the subject
+        best_col = max(range(N), key=lambda col_idx: (score_lst[col_idx][0], -col_idx))
+        return [best_col]
+    # subject columns are usually on the left
+    return key_col_lst[:MAX_KEY_COLS]
+
+class KeyColumnGraph(RelationGraph):
+    def __init__(self, pack_size=0):
+        super(KeyColumnGraph, self).__init__(pack_size=pack_size)
+
+    def gen_row_rels(self, table, row_idx_lst=None):
+        topic_entity = self.get_topic_entity(table)
+        out_graph_lst = []
+        col_data = table['columns']
+        N = len(col_data)
+        row_data = table['rows']
+        key_col_lst = get_key_cols(table)
+        key_col_set = set(key_col_lst)
+        for row_idx in self.get_row_idx_lst(table, row_idx_lst):
+            row_info = row_data[row_idx]
+            for sub_col_idx in key_col_lst:
+                sub_name = col_data[sub_col_idx]['text']
+                sub = row_info['cells'][sub_col_idx]['text']
+                for obj_col_idx in range(N):
+                    # a pair of key columns is emitted once
+                    if (obj_col_idx == sub_col_idx) or (obj_col_idx in key_col_set and obj_col_idx < sub_col_idx):
+                        continue
+                    rel_name = col_data[obj_col_idx]['text']
+                    obj = row_info['cells'][obj_col_idx]['text']
+                    graph = RelationTag.get_annotated_text(topic_entity, sub_name, sub, rel_name, obj)
+                    graph_info = {
+                        'table_id':table['tableId'],
+                        'row':row_idx,
+                        'sub_col':sub_col_idx,
+                        'obj_col':obj_col_idx,
+                        'graph':graph
+                    }
+                    out_graph_lst.append(graph_info)
+
+        return out_graph_lst
@@ -3,9 +3,21 @@ import numpy as np
 from table2txt.graph_strategy.strategy import Strategy 
 from table2txt.graph_strategy.rel_tags import RelationTag
 
+def get_graph_size(table, row_idx_lst=None):
+    # number of passages RelationGraph emits for the rows, topic passages plus every column pair
+    N = len(table['columns'])
+    num_rows = len(table['rows']) if row_idx_lst is None else len(row_idx_lst)
+    num_topic_rels = N if table['documentTitle'].strip() != '' else 0
+    return num_rows * (num_topic_rels + N * (N - 1) // 2)
+
 class RelationGraph(Strategy):
-    def __init__(self):
+    # With pack_size > 0, the triples of a row are packed into passages of at most pack_size
+    # (whitespace) tokens, and the tag of a passage lists the column pairs in col_pairs.
+    # The size is counted on the tagged text the reader gets (RelationTag.get_tagged_packed_text),
+    # which is longer than the passage text.
+    def __init__(self, pack_size=0):
         super(RelationGraph, self).__init__()
+        self.pack_size = pack_size
 
     def get_topic_entity(self, table):
         topic_entity = table['documentTitle'].strip()
@@ -23,7 +35,12 @@ class RelationGraph(Strategy):
             for cell_info in cell_data:
                 cell_info['text'] = cell_info['text'].strip()
 
-    def gen_topic_entity_rels(self, table):
+    def get_row_idx_lst(self, table, row_idx_lst):
+        if row_idx_lst is None:
+            row_idx_lst = range(len(table['rows']))
+        return row_idx_lst
+
+    def gen_topic_entity_rels(self, table, row_idx_lst=None):
         out_graph_lst = []
         topic_entity = self.get_topic_entity(table)
         if topic_entity == '':
@@ -31,7 +48,8 @@ class RelationGraph(Strategy):
 
         col_data = table['columns']
         row_data = table['rows']
-        for row_idx, row_info in enumerate(row_data):
+        for row_idx in self.get_row_idx_lst(table, row_idx_lst):
+            row_info = row_data[row_idx]
             for col_idx, col_info in enumerate(col_data):
                 rel_name = col_info['text']
                 obj = row_info['cells'][col_idx]['text'] 
@@ -46,13 +64,14 @@ class RelationGraph(Strategy):
                 out_graph_lst.append(graph_info)
         return out_graph_lst
 
-    def gen_row_rels(self, table):
+    def gen_row_rels(self, table, row_idx_lst=None):
         topic_entity = self.get_topic_entity(table)
         out_graph_lst = []
         col_data = table['columns']
         N = len(col_data)
         row_data = table['rows']
-        for row_idx, row_info in enumerate(row_data):
+        for row_idx in self.get_row_idx_lst(table, row_idx_lst):
+            row_info = row_data[row_idx]
             for sub_col_idx in range(N-1):
                 sub_name = col_data[sub_col_idx]['text']
                 sub = row_info['cells'][sub_col_idx]['text']
@@ -71,11 +90,67 @@ class RelationGraph(Strategy):
         
         return out_graph_lst
 
-    def generate(self, table):
+    def generate(self, table, row_idx_lst=None):
+        # row_idx_lst, if given, is the subset of rows to linearize. Tags keep the original row numbers.
         self.update_cells(table)
-        graph_lst_1 = self.gen_topic_entity_rels(table)
-        graph_lst_2 = self.gen_row_rels(table)
-        return graph_lst_1 + graph_lst_2
+        graph_lst_1 = self.gen_topic_entity_rels(table, row_idx_lst)
+        graph_lst_2 = self.gen_row_rels(table, row_idx_lst)
+        graph_lst = graph_lst_1 + graph_lst_2
+        if self.pack_size > 0:
+            graph_lst = self.pack_graphs(table, graph_lst)
+        return graph_lst
+
+    def pack_graphs(self, table, graph_lst):
+        topic_entity = self.get_topic_entity(table)
+        col_data = table['columns']
+        row_data = table['rows']
+        row_graph_dict = {}
+        for graph_info in graph_lst:
+            row = graph_info['row']
+            if row not in row_graph_dict:
+                row_graph_dict[row] = []
+            row_graph_dict[row].append(graph_info)
+
+        title_size = len(topic_entity.split()) + 1 # [T] title
+        out_graph_lst = []
+        for row in sorted(row_graph_dict.keys()):
+            cell_data = row_data[row]['cells']
+            triple_lst = []
+            col_pair_lst = []
+            buffer_size = title_size
+            for graph_info in row_graph_dict[row]:
+                sub_col = graph_info['sub_col']
+                obj_col = graph_info['obj_col']
+                sub_name = None if sub_col is None else col_data[sub_col]['text']
+                sub = None if sub_col is None else cell_data[sub_col]['text']
+                triple = RelationTag.get_annotated_triple(sub_name, sub, col_data[obj_col]['text'], 
+                                                          cell_data[obj_col]['text'])
+                obj_name = col_data[obj_col]['text']
+                tagged_triple = RelationTag.get_tagged_triple(sub_name, sub, obj_name, cell_data[obj_col]['text'])
+                triple_size = len(tagged_triple.split())
+                if (len(triple_lst) > 0) and (buffer_size + triple_size > self.pack_size):
+                    out_graph_lst.append(self.get_packed_graph(table, row, topic_entity, triple_lst, col_pair_lst))
+                    triple_lst = []
+                    col_pair_lst = []
+                    buffer_size = title_size
+                triple_lst.append(triple)
+                col_pair_lst.append([sub_col, obj_col])
+                buffer_size += triple_size
+            if len(triple_lst) > 0:
+                out_graph_lst.append(self.get_packed_graph(table, row, topic_entity, triple_lst, col_pair_lst))
+        return out_graph_lst
+
+    def get_packed_graph(self, table, row, topic_entity, triple_lst, col_pair_lst):
+        # sub_col and obj_col are the first pair, for readers of single pair tags
+        graph_info = {
+            'table_id':table['tableId'],
+            'row':row,
+            'sub_col':col_pair_lst[0][0],
+            'obj_col':col_pair_lst[0][1],
+            'col_pairs':col_pair_lst,
+            'graph':RelationTag.get_packed_text(topic_entity, triple_lst)
+        }
+        return graph_info
 
 
 
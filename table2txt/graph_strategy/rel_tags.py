@@ -18,15 +18,37 @@ class RelationTag:
         assert (obj_name is not None)
         assert(obj is not None)
 
+        out_text = title + '  ,  ' + RelationTag.get_annotated_triple(sub_name, sub, obj_name, obj)
+
+        return out_text
+
+    @staticmethod
+    def get_annotated_triple(sub_name, sub, obj_name, obj):
+        if sub_name is None:
+            sub_name = ''
+        if sub is None:
+            sub = ''
         sub_part = sub_name + '  ' + sub
         obj_part = obj_name + '  ' + obj
-        out_text = title + '  ,  ' + sub_part.strip() + '  ' + obj_part.strip() + ' . '
+        out_text = sub_part.strip() + '  ' + obj_part.strip() + ' . '
+        return out_text
 
+    @staticmethod
+    def get_packed_text(title, triple_text_lst):
+        # several triples of a row in one passage, the title is written once
+        assert (title is not None)
+        out_text = title + '  ,  ' + ''.join(triple_text_lst)
         return out_text
     
     @staticmethod
     def get_tagged_text(title, sub_name, sub, obj_name, obj):
         assert (title is not None)
+        out_text = '%s %s %s' % (RelationTag.tag_title, title,
+                                 RelationTag.get_tagged_triple(sub_name, sub, obj_name, obj))
+        return out_text
+
+    @staticmethod
+    def get_tagged_triple(sub_name, sub, obj_name, obj):
         if sub_name is None:
             sub_name = ''
         if sub is None:
@@ -34,10 +56,15 @@ class RelationTag:
         assert (obj_name is not None)
         assert(obj is not None)
 
-        out_text = '%s %s %s %s %s %s %s %s %s %s' % (RelationTag.tag_title, title, 
-                                                      RelationTag.tag_sub_name, sub_name, 
-                                                      RelationTag.tag_sub, sub, 
-                                                      RelationTag.tag_obj_name, obj_name, 
-                                                      RelationTag.tag_obj, obj)
+        out_text = '%s %s %s %s %s %s %s %s' % (RelationTag.tag_sub_name, sub_name,
+                                                RelationTag.tag_sub, sub,
+                                                RelationTag.tag_obj_name, obj_name,
+                                                RelationTag.tag_obj, obj)
+        return out_text
 
+    @staticmethod
+    def get_tagged_packed_text(title, tagged_triple_lst):
+        # the tagged text of a packed passage, the title is written once as in get_packed_text
+        assert (title is not None)
+        out_text = '%s %s %s' % (RelationTag.tag_title, title, ' '.join(tagged_triple_lst))
         return out_text
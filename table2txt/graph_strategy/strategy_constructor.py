@@ -1,8 +1,31 @@
 from table2txt.graph_strategy.rel_graph import RelationGraph
+from table2txt.graph_strategy.key_col_graph import KeyColumnGraph
+from table2txt.graph_strategy.complete_graph import CompleteGraph
+from table2txt.graph_strategy.graph_no_caption import GraphNoCaption
 
-def get_strategy(name):
+# RelationTemplate and SlidingStrategy need transformers (and webnlg), they are imported when asked for.
+# table2graph writes the strategies in GRAPH_STRATEGY_NAME_LST, which return graph lists with tags and can pack
+# triples. All of them can be compared with table2txt/bench_strategy.py
+STRATEGY_NAME_LST = ['RelationGraph', 'KeyColumnGraph', 'CompleteGraph', 'GraphNoCaption', 'RelationTemplate',
+                     'SlidingStrategy']
+GRAPH_STRATEGY_NAME_LST = ['RelationGraph', 'KeyColumnGraph']
+
+def get_strategy(name, pack_size=0):
+    if (pack_size > 0) and (name not in GRAPH_STRATEGY_NAME_LST):
+        raise ValueError('Stategy (%s) does not support packing.' % name)
     if name == 'RelationGraph':
-        return RelationGraph()
+        return RelationGraph(pack_size=pack_size)
+    elif name == 'KeyColumnGraph':
+        return KeyColumnGraph(pack_size=pack_size)
+    elif name == 'CompleteGraph':
+        return CompleteGraph()
+    elif name == 'GraphNoCaption':
+        return GraphNoCaption()
+    elif name == 'RelationTemplate':
+        from table2txt.graph_strategy.rel_template import RelationTemplate
+        return RelationTemplate()
+    elif name == 'SlidingStrategy':
+        from table2txt.table2tokens import SlidingStrategy
+        return SlidingStrategy()
     else:
         raise ValueError('Stategy (%s) Not supported.' % name)
-
@@ -4,6 +4,7 @@ from tqdm import tqdm
 import argparse
 import re
 from webnlg.data.template_data import TemplateTag
+import table_store
 
 def get_text_meta(text_dir, text_part_name):
     index = text_part_name.index('_part_')
@@ -17,25 +18,17 @@ def get_text_meta(text_dir, text_part_name):
     return meta_info_lst
 
 def read_table_file(table_lst, data_file, table_filter_set):
-    with open(data_file) as f:
-        for line in tqdm(f):
-            table = json.loads(line)
-            table_id = table['tableId']
-            if table_filter_set is not None:
-                if table_id not in table_filter_set:
-                    continue
-            table_lst.append(table)
+    for table in table_store.load_tables(data_file):
+        table_id = table['tableId']
+        if table_filter_set is not None:
+            if table_id not in table_filter_set:
+                continue
+        table_lst.append(table)
     return table_lst
 
 def read_tables(args):
     table_data_file = os.path.join('/home/cc/data', args.dataset, 'tables', 'tables.jsonl') 
-    table_lst = []
-    read_table_file(table_lst, table_data_file, None)
-    table_dict = {}
-    for table in table_lst:
-        table_id = table['tableId']
-        table_dict[table_id] = table
-    return table_dict
+    return table_store.load_table_dict(table_data_file)
 
 def get_key(table_id, row, sub_col, obj_col):
     return f'{table_id}_{row}_{sub_col}_{obj_col}'
@@ -0,0 +1,179 @@
+import json
+import os
+import copy
+import hashlib
+import numpy as np
+from table2txt import graph_state
+
+# Byte-identical passages are stored once. The first occurrence keeps its tag in passages.jsonl, every
+# later occurrence only adds its tag to passages.jsonl_postings.jsonl as {"p_id": .., "tag": {..}}, so the
+# encoder and the index see unique text only. Retrieval expands a passage to all its tags.
+# With --incremental, the hash table is kept in passages.jsonl_dedup.npz for the next run, and passages
+# retired in earlier runs are not matched. A passage retired in this run that still has live postings stays
+# indexed, a {"p_id": .., "tag": null} posting marks that its own tag is gone.
+
+def get_posting_file(passage_file):
+    return passage_file + '_postings.jsonl'
+
+def get_dedup_map_file(passage_file):
+    return passage_file + '_dedup.npz'
+
+# The first p_id of a passage is kept in an open addressing table of 8-byte hashes (12 bytes a slot, at most
+# 3/4 full), it grows up to max_passages keys. After that, passages that are not in the table are written as
+# new passages, so memory stays bounded and the dedup only misses duplicates of the later passages.
+MAX_PASSAGES = 50000000
+MIN_SLOTS = 1 << 16
+
+def get_passage_key(passage):
+    # 0 marks an empty slot
+    key = int.from_bytes(hashlib.blake2b(passage.encode('utf-8'), digest_size=8).digest(), 'little')
+    return key if key > 0 else 1
+
+class PassageDedup:
+    def __init__(self, passage_file, max_passages=MAX_PASSAGES, mode='w', retired_range_lst=None):
+        # with mode 'a', the hash table of the previous run is loaded and postings are appended,
+        # retired_range_lst (graph_state.read_retired_ranges) has the passages that can not be matched
+        self.passage_file = passage_file
+        self.max_passages = max_passages
+        self.retired_range_lst = retired_range_lst if retired_range_lst is not None else []
+        self.num_keys = 0
+        map_file = get_dedup_map_file(passage_file)
+        if (mode == 'a') and os.path.exists(map_file):
+            map_data = np.load(map_file)
+            self.set_slots(map_data['key_slots'], map_data['p_id_slots'])
+            self.num_keys = int(map_data['num_keys'])
+        else:
+            self.set_slots(np.zeros(MIN_SLOTS, dtype=np.uint64), np.zeros(MIN_SLOTS, dtype=np.uint32))
+        self.num_missed = 0
+        self.f_o = open(get_posting_file(passage_file), mode)
+        self.num_postings = 0
+
+    def set_slots(self, key_slots, p_id_slots):
+        # the numpy arrays are for growing, single slots go through memoryviews which give python ints
+        self.key_slots = key_slots
+        self.p_id_slots = p_id_slots
+        self.key_view = memoryview(key_slots)
+        self.p_id_view = memoryview(p_id_slots)
+
+    def find_slot(self, passage_key):
+        key_view = self.key_view
+        mask = len(key_view) - 1
+        slot = passage_key & mask
+        while True:
+            slot_key = key_view[slot]
+            if slot_key == 0 or slot_key == passage_key:
+                return slot
+            slot = (slot + 1) & mask
+
+    def get_p_id(self, passage_key):
+        slot = self.find_slot(passage_key)
+        if self.key_view[slot] == 0:
+            return None
+        p_id = self.p_id_view[slot]
+        if (len(self.retired_range_lst) > 0) and graph_state.is_retired(self.retired_range_lst, p_id):
+            return None
+        return p_id
+
+    def add(self, passage_key, p_id):
+        if self.num_keys >= self.max_passages:
+            self.num_missed += 1
+            return
+        if (self.num_keys + 1) * 4 > len(self.key_slots) * 3:
+            self.grow()
+        slot = self.find_slot(passage_key)
+        if self.key_view[slot] == 0:
+            self.num_keys += 1
+        # a key of a retired passage is taken over by the new passage
+        self.key_view[slot] = passage_key
+        self.p_id_view[slot] = p_id
+
+    def grow(self):
+        # all keys are moved at once, a key whose slot is taken (or wanted by another key) tries the next slot
+        old_slot_arr = np.nonzero(self.key_slots)[0]
+        key_arr = self.key_slots[old_slot_arr]
+        p_id_arr = self.p_id_slots[old_slot_arr]
+        num_slots = len(self.key_slots) * 2
+        mask = np.uint64(num_slots - 1)
+        self.set_slots(np.zeros(num_slots, dtype=np.uint64), np.zeros(num_slots, dtype=np.uint32))
+        slot_arr = (key_arr & mask).astype(np.int64)
+        while len(key_arr) > 0:
+            free_pos_arr = np.nonzero(self.key_slots[slot_arr] == 0)[0]
+            _, first_idx_arr = np.unique(slot_arr[free_pos_arr], return_index=True)
+            put_pos_arr = free_pos_arr[first_idx_arr]
+            self.key_slots[slot_arr[put_pos_arr]] = key_arr[put_pos_arr]
+            self.p_id_slots[slot_arr[put_pos_arr]] = p_id_arr[put_pos_arr]
+            left_mask = np.ones(len(key_arr), dtype=bool)
+            left_mask[put_pos_arr] = False
+            key_arr = key_arr[left_mask]
+            p_id_arr = p_id_arr[left_mask]
+            slot_arr = (slot_arr[left_mask] + 1) & (num_slots - 1)
+
+    def write_posting(self, p_id, tag_text):
+        self.f_o.write('{"p_id": %d, "tag": %s}\n' % (p_id, tag_text))
+        self.num_postings += 1
+
+    def close(self, save_map=False):
+        self.f_o.close()
+        if save_map:
+            map_file = get_dedup_map_file(self.passage_file)
+            tmp_file = map_file + '.tmp.npz'
+            np.savez(tmp_file, key_slots=self.key_slots, p_id_slots=self.p_id_slots, num_keys=self.num_keys)
+            os.replace(tmp_file, map_file)
+
+def mark_retired_passages(passage_file, retired_range_lst):
+    # a retired passage (graph_state.read_retired_ranges) with postings of live tables stays indexed,
+    # a null tag posting marks each of them. Returns the retired p_ids that stay indexed.
+    kept_p_id_set = set()
+    posting_file = get_posting_file(passage_file)
+    if (len(retired_range_lst) == 0) or (not os.path.exists(posting_file)):
+        return kept_p_id_set
+    tmp_file = posting_file + '.tmp'
+    with open(posting_file) as f, open(tmp_file, 'w') as f_o:
+        for line in f:
+            item = json.loads(line)
+            if item['tag'] is None:
+                continue
+            if graph_state.is_retired(retired_range_lst, item['p_id']):
+                kept_p_id_set.add(item['p_id'])
+            f_o.write(line)
+        for p_id in sorted(kept_p_id_set):
+            f_o.write('{"p_id": %d, "tag": null}\n' % p_id)
+    os.replace(tmp_file, posting_file)
+    return kept_p_id_set
+
+def get_posting_table_id(item):
+    return item['tag']['table_id'] if item['tag'] is not None else None
+
+def read_postings(passage_file):
+    # p_id -> the tags of the duplicates of the passage, empty if passages were not deduplicated
+    posting_dict = {}
+    posting_file = get_posting_file(passage_file)
+    if not os.path.exists(posting_file):
+        return posting_dict
+    with open(posting_file) as f:
+        for line in f:
+            item = json.loads(line)
+            p_id = item['p_id']
+            if p_id not in posting_dict:
+                posting_dict[p_id] = []
+            posting_dict[p_id].append(item['tag'])
+    return posting_dict
+
+def expand_passage_tags(data, posting_dict):
+    # a retrieved passage is followed by a copy (same text and score) for each of its duplicate tags,
+    # a retired passage (null tag) is only its duplicates
+    if len(posting_dict) == 0:
+        return
+    for item in data:
+        ctx_lst = []
+        for ctx in item['ctxs']:
+            tag_lst = posting_dict.get(int(ctx['id']), [])
+            if None not in tag_lst:
+                ctx_lst.append(ctx)
+            for tag in tag_lst:
+                if tag is None:
+                    continue
+                dup_ctx = copy.copy(ctx)
+                dup_ctx['tag'] = tag
+                ctx_lst.append(dup_ctx)
+        item['ctxs'] = ctx_lst
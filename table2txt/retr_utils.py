@@ -1,6 +1,7 @@
 from tqdm import tqdm
 from table2txt.graph_strategy.rel_tags import RelationTag
 from table2txt.table2tokens import tag_slide_tokens
+from table2txt import row_budget
 
 def tag_data_text(data, table_dict, strategy):
     tag_func = None
@@ -24,6 +25,8 @@ def type_process(col):
     return ret_col 
 
 def tag_rel_graph(item, table_dict):
+    # a passage of a table no longer in the table store is dropped
+    item['ctxs'] = [a for a in item['ctxs'] if a['tag']['table_id'] in table_dict]
     passage_info_lst = item['ctxs']
     for passage_info in passage_info_lst:
         tag_info = passage_info['tag']
@@ -32,22 +35,60 @@ def tag_rel_graph(item, table_dict):
         sub_col = tag_info['sub_col']
         obj_col = tag_info['obj_col']
         table_data = table_dict[table_id]
-        title = table_data['documentTitle']
-        
-        sub_col = type_process(sub_col)
-        obj_col = type_process(obj_col) 
-         
-        if sub_col is None:
-            sub_name = ''
-            sub = ''
+        # a packed passage lists all its column pairs, its title is tagged once
+        col_pair_lst = tag_info.get('col_pairs', None)
+        if col_pair_lst is None:
+            passage_info['text'] = get_tagged_pair_text(table_data, row, sub_col, obj_col)
         else:
-            sub_name = table_data['columns'][sub_col]['text']
-            sub = table_data['rows'][row]['cells'][sub_col]['text']
+            tagged_triple_lst = [RelationTag.get_tagged_triple(*get_pair_cells(table_data, row, a, b))
+                                 for a, b in col_pair_lst]
+            passage_info['text'] = RelationTag.get_tagged_packed_text(table_data['documentTitle'], tagged_triple_lst)
+
+def get_pair_cells(table_data, row, sub_col, obj_col):
+    sub_col = type_process(sub_col)
+    obj_col = type_process(obj_col) 
+     
+    if sub_col is None:
+        sub_name = ''
+        sub = ''
+    else:
+        sub_name = table_data['columns'][sub_col]['text']
+        sub = table_data['rows'][row]['cells'][sub_col]['text']
+
+    obj_name = table_data['columns'][obj_col]['text']
+    obj = table_data['rows'][row]['cells'][obj_col]['text'] 
+    return sub_name, sub, obj_name, obj
+
+def get_tagged_pair_text(table_data, row, sub_col, obj_col):
+    title = table_data['documentTitle']
+    sub_name, sub, obj_name, obj = get_pair_cells(table_data, row, sub_col, obj_col)
+    tagged_text = RelationTag.get_tagged_text(title, sub_name, sub, obj_name, obj)        
+    return tagged_text
 
-        obj_name = table_data['columns'][obj_col]['text']
-        obj = table_data['rows'][row]['cells'][obj_col]['text'] 
-        tagged_text = RelationTag.get_tagged_text(title, sub_name, sub, obj_name, obj)        
-        passage_info['text'] = tagged_text
+def add_table_aliases(data, table_alias_dict):
+    # exact duplicates are not indexed, a passage of their representative lists them in tag['alias_table_ids']
+    if len(table_alias_dict) == 0:
+        return
+    for item in data:
+        for passage_info in item['ctxs']:
+            tag_info = passage_info['tag']
+            alias_lst = table_alias_dict.get(tag_info['table_id'], None)
+            if alias_lst is not None:
+                tag_info['alias_table_ids'] = alias_lst
+
+def add_skipped_rows(data, sample_dict):
+    # a retrieved table over the row budget lists the rows that were not indexed in item['skipped_rows'],
+    # so they can be read from the table store when answering
+    if len(sample_dict) == 0:
+        return
+    for item in data:
+        skipped_row_dict = {}
+        for passage_info in item['ctxs']:
+            table_id = passage_info['tag']['table_id']
+            if (table_id in sample_dict) and (table_id not in skipped_row_dict):
+                skipped_row_dict[table_id] = row_budget.get_skipped_rows(sample_dict[table_id])
+        if len(skipped_row_dict) > 0:
+            item['skipped_rows'] = skipped_row_dict
 
 def group_passages(passage_lst):
     table_dict = {}
@@ -66,6 +107,10 @@ def update_min_tables(item, top_n, min_tables):
     assert(top_n >= 25)
     passage_lst = item['ctxs']
     top_passage_lst = passage_lst[:top_n]
+    if len(passage_lst) < top_n:
+        # passages were dropped after retrieval
+        item['ctxs'] = passage_lst
+        return
     table_lst = [a['tag']['table_id'] for a in top_passage_lst]
     table_set = set(table_lst)
     top_n_tables = len(table_set)
@@ -146,6 +191,9 @@ def process_train(train_data, top_n, table_dict, strategy, min_tables):
             #else:
             #    continue
         
+        if len(ctxs) < top_n: # passages were dropped after retrieval
+            continue
+
         if min(labels) > 0: # all positives
             continue
             #if len(neg_lst) > 0:
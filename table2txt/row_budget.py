@@ -0,0 +1,145 @@
+import os
+import json
+import heapq
+import hashlib
+import random
+import table_store
+
+# Per-table row budget for linearization. A table with more rows than the budget is indexed with a subset of
+# rows that covers as many distinct cell values as possible. The choice only depends on the seed and the
+# tableId, so it is the same for any worker count or table order.
+# Rows that are not indexed stay in the table store, passage tags keep the original row numbers.
+
+def get_sample_file(passage_file):
+    return passage_file + '_sampled_rows.jsonl'
+
+def get_table_rng(seed, table_id):
+    key = ('%d\0%s' % (seed, table_id)).encode('utf-8')
+    table_seed = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+    return random.Random(table_seed)
+
+# A column with at least this ratio of distinct values (an id, a date, a count) is left out of the coverage,
+# otherwise every row adds a new value and all rows look equally useful.
+MAX_DISTINCT_RATIO = 0.9
+
+def get_coverage_cols(row_data, row_idx_lst):
+    num_cols = len(row_data[row_idx_lst[0]]['cells'])
+    value_set_lst = [set() for _ in range(num_cols)]
+    for row_idx in row_idx_lst:
+        for col, cell in enumerate(row_data[row_idx]['cells'][:num_cols]):
+            value_set_lst[col].add(cell['text'].strip().lower())
+    max_distinct = MAX_DISTINCT_RATIO * len(row_idx_lst)
+    return [col for col in range(num_cols) if len(value_set_lst[col]) < max_distinct]
+
+def sample_rows(table, row_idx_lst, max_rows, seed):
+    if row_idx_lst is None:
+        row_idx_lst = list(range(len(table['rows'])))
+    if len(row_idx_lst) <= max_rows:
+        return row_idx_lst
+    rng = get_table_rng(seed, table['tableId'])
+    cand_lst = list(row_idx_lst)
+    rng.shuffle(cand_lst)
+    # greedy max coverage, each pick is the row adding the most unseen (column, value) cells,
+    # ties go to the earlier row in the shuffled order. The gain of a row only drops as cells are seen,
+    # so a stale gain popped from the heap is recomputed and pushed back instead of rescanning all rows.
+    row_data = table['rows']
+    col_lst = get_coverage_cols(row_data, cand_lst)
+    row_key_lst = []
+    for row_idx in cand_lst:
+        cell_lst = row_data[row_idx]['cells']
+        row_key_lst.append(set((col, cell_lst[col]['text'].strip().lower()) for col in col_lst if col < len(cell_lst)))
+    heap = [(-len(keys), pos) for pos, keys in enumerate(row_key_lst)]
+    heapq.heapify(heap)
+    seen_cell_set = set()
+    sample_lst = []
+    while len(sample_lst) < max_rows:
+        neg_gain, pos = heapq.heappop(heap)
+        if neg_gain == 0:
+            # nothing new is left, the rest of the budget is filled in shuffled order
+            rest_pos_lst = sorted([pos] + [a[1] for a in heap])
+            sample_lst.extend(cand_lst[a] for a in rest_pos_lst[:(max_rows - len(sample_lst))])
+            break
+        gain = len(row_key_lst[pos] - seen_cell_set)
+        if gain < -neg_gain:
+            heapq.heappush(heap, (-gain, pos))
+            continue
+        seen_cell_set.update(row_key_lst[pos])
+        sample_lst.append(cand_lst[pos])
+    sample_lst.sort()
+    return sample_lst
+
+class RowBudget:
+    # Applies the budget table by table and records the rows indexed for every table over the budget
+    def __init__(self, max_rows, seed, passage_file, mode='w'):
+        self.max_rows = max_rows
+        self.seed = seed
+        self.f_o = open(get_sample_file(passage_file), mode)
+        self.num_tables = 0
+        self.num_rows = 0
+        self.num_indexed_rows = 0
+
+    def get_rows(self, table_lst, row_idx_lst_lst):
+        # table_lst is a table alone or the chunks of one table (table_store.group_table_chunks),
+        # row_idx_lst_lst has the candidate rows of each (None for all), the budget is for the whole table
+        num_rows = sum([len(t['rows']) if r is None else len(r) for t, r in zip(table_lst, row_idx_lst_lst)])
+        if num_rows <= self.max_rows:
+            return row_idx_lst_lst
+        row_data = []
+        cand_lst = []
+        offset_lst = []
+        for table, row_idx_lst in zip(table_lst, row_idx_lst_lst):
+            offset = len(row_data)
+            offset_lst.append(offset)
+            if row_idx_lst is None:
+                row_idx_lst = range(len(table['rows']))
+            cand_lst.extend([offset + a for a in row_idx_lst])
+            row_data.extend(table['rows'])
+        table_id = table_store.get_parent_table_id(table_lst[0])
+        sample_lst = sample_rows({'tableId':table_id, 'rows':row_data}, cand_lst, self.max_rows, self.seed)
+        # rows are numbered from the first chunk, chunks are consecutive
+        row_start = table_store.get_row_start(table_lst[0])
+        item = {
+            'table_id':table_id,
+            'row_start':row_start,
+            'num_rows':len(row_data),
+            'rows':[row_start + a for a in sample_lst]
+        }
+        self.f_o.write(json.dumps(item) + '\n')
+        self.num_tables += 1
+        self.num_rows += num_rows
+        self.num_indexed_rows += len(sample_lst)
+        offset_lst.append(len(row_data))
+        out_row_idx_lst_lst = [[] for _ in table_lst]
+        chunk_idx = 0
+        for row_idx in sample_lst:
+            while row_idx >= offset_lst[chunk_idx + 1]:
+                chunk_idx += 1
+            out_row_idx_lst_lst[chunk_idx].append(row_idx - offset_lst[chunk_idx])
+        return out_row_idx_lst_lst
+
+    def close(self):
+        self.f_o.close()
+
+def read_sampled_rows(passage_file):
+    # tableId -> the sample records of the table, only for the tables over the budget
+    sample_dict = {}
+    sample_file = get_sample_file(passage_file)
+    if not os.path.exists(sample_file):
+        return sample_dict
+    with open(sample_file) as f:
+        for line in f:
+            item = json.loads(line)
+            if item['table_id'] not in sample_dict:
+                sample_dict[item['table_id']] = []
+            sample_dict[item['table_id']].append(item)
+    return sample_dict
+
+def get_skipped_rows(sample_item_lst):
+    # the rows of a table that are not indexed, they are read from the table store when needed
+    skipped_row_lst = []
+    for item in sample_item_lst:
+        indexed_row_set = set(item['rows'])
+        row_start = item['row_start']
+        skipped_row_lst.extend([a for a in range(row_start, row_start + item['num_rows']) if a not in indexed_row_set])
+    skipped_row_lst.sort()
+    return skipped_row_lst
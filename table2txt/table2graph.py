@@ -5,22 +5,158 @@ from tqdm import tqdm
 import numpy as np
 import random
 from multiprocessing import Pool as ProcessPool
-from table2txt.graph_strategy.strategy_constructor import get_strategy
+import table_store
+import jsonl_io
+import table_cluster
+from table2txt import row_budget
+from table2txt import passage_dedup
+from table2txt import graph_state
+from table2txt.graph_strategy.strategy_constructor import get_strategy, GRAPH_STRATEGY_NAME_LST
+from table2txt.graph_strategy.rel_graph import get_graph_size
 
 def read_tables(data_file):
-    table_lst = []
-    with open(data_file) as f:
-        for line in tqdm(f):
-            table = json.loads(line)
-            table_lst.append(table)
-    return table_lst
-
-def init_worker(strategy_name):
+    # strategies strip cell text in place, so linearization reads its own copy instead of the shared cache
+    return table_store.read_tables(table_store.resolve_table_file(data_file))
+
+def init_worker(strategy_name, dedup_passages=0, pack_size=0):
     global g_strategy
-    g_strategy = get_strategy(strategy_name) 
+    global g_dedup_passages
+    g_strategy = get_strategy(strategy_name, pack_size=pack_size)
+    g_dedup_passages = dedup_passages
+
+def process_table(table_info):
+    table, row_idx_lst = table_info
+    if row_idx_lst is None:
+        graph_lst = g_strategy.generate(table)
+    else:
+        graph_lst = g_strategy.generate(table, row_idx_lst=row_idx_lst)
+    if 'parentTableId' in table:
+        # passages of a table chunk are tagged with the parent table and its row numbers
+        row_start = table_store.get_row_start(table)
+        for graph_info in graph_lst:
+            graph_info['table_id'] = table['parentTableId']
+            graph_info['row'] += row_start
+    return encode_graphs(graph_lst, g_dedup_passages)
+
+def get_shard_manifest_file(passage_file):
+    return passage_file + '_shards.json'
+
+def get_shard_file(passage_file, shard_no):
+    return passage_file + '_part_%05d' % shard_no
+
+def read_shard_manifest(passage_file):
+    manifest_file = get_shard_manifest_file(passage_file)
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    return manifest
+
+def remove_shards(passage_file):
+    manifest = read_shard_manifest(passage_file)
+    if manifest is None:
+        return
+    for shard_info in manifest['shards']:
+        if os.path.exists(shard_info['file']):
+            os.remove(shard_info['file'])
+    os.remove(get_shard_manifest_file(passage_file))
+
+class PassageWriter:
+    # Writes passages.jsonl and, with shard_size > 0, the same lines to shard files of at most shard_size
+    # passages each, so the encoder reads the shards without another pass over passages.jsonl.
+    # Every write is one complete passage line.
+    # With compress_ext (jsonl_io.ZSTD_EXT or GZIP_EXT), passages.jsonl is compressed, the shards are not.
+    # The retriever and the on-disk indexer read plain passages.jsonl, so index_tables never compresses it.
+    def __init__(self, passage_file, shard_size=0, mode='w', num_passages=0, compress_ext=''):
+        # with mode 'a', passages are appended after the num_passages already in passage_file,
+        # and the shards only have the appended passages
+        self.passage_file = passage_file
+        self.shard_size = shard_size
+        self.f_o = jsonl_io.open_file(passage_file + compress_ext, mode)
+        self.f_shard = None
+        self.shard_lst = []
+        self.num_passages = num_passages
+
+    def open_shard(self):
+        shard_file = get_shard_file(self.passage_file, len(self.shard_lst))
+        self.f_shard = open(shard_file, 'w')
+        shard_info = {
+            'file':shard_file,
+            'start_p_id':self.num_passages + 1,
+            'num_passages':0
+        }
+        self.shard_lst.append(shard_info)
+
+    def write(self, passage_line):
+        self.f_o.write(passage_line)
+        if self.shard_size > 0:
+            self.write_shard(passage_line)
+        self.num_passages += 1
 
-def process_table(table):
-    return g_strategy.generate(table)
+    def write_shard(self, passage_line):
+        if self.f_shard is None:
+            self.open_shard()
+        self.f_shard.write(passage_line)
+        shard_info = self.shard_lst[-1]
+        shard_info['num_passages'] += 1
+        if shard_info['num_passages'] >= self.shard_size:
+            self.f_shard.close()
+            self.f_shard = None
+
+    def close(self):
+        self.f_o.close()
+        if self.f_shard is not None:
+            self.f_shard.close()
+            self.f_shard = None
+        if self.shard_size <= 0:
+            return None
+        manifest = {
+            'passage_file':self.passage_file,
+            'shard_size':self.shard_size,
+            'num_passages':self.num_passages,
+            'shards':self.shard_lst
+        }
+        manifest_file = get_shard_manifest_file(self.passage_file)
+        tmp_file = manifest_file + '.tmp'
+        with open(tmp_file, 'w') as f_o:
+            f_o.write(json.dumps(manifest))
+        os.replace(tmp_file, manifest_file)
+        return manifest_file
+
+def get_row_filter(args, input_table_file):
+    # with --skip_cluster_rows, rows already linearized for a near-duplicate table are not repeated
+    if not getattr(args, 'skip_cluster_rows', 0):
+        return None
+    table_cluster_dict = table_cluster.read_table_clusters(table_store.resolve_table_file(input_table_file))
+    return table_cluster.ClusterRowFilter(table_cluster_dict)
+
+def get_row_budget(args, out_passage_file, mode):
+    # with --max_table_rows, long tables are indexed with a diverse subset of their rows
+    max_table_rows = getattr(args, 'max_table_rows', 0)
+    if max_table_rows <= 0:
+        return None
+    return row_budget.RowBudget(max_table_rows, getattr(args, 'row_seed', 0), out_passage_file, mode=mode)
+
+def iter_table_infos(input_table_file, row_filter, table_row_budget, table_diff, graph_stat):
+    # tables are read lazily, only the tables in flight are in memory
+    # with a row budget, the chunks of a table are read together so the budget is for the whole table
+    table_file = table_store.resolve_table_file(input_table_file)
+    table_itr = table_store.iter_tables(table_file, show_progress=False)
+    if table_row_budget is not None:
+        group_itr = table_store.group_table_chunks(table_itr)
+    else:
+        group_itr = ([a] for a in table_itr)
+    for table_lst in group_itr:
+        if (table_diff is not None) and (not table_diff.is_group_updated(table_lst)):
+            continue
+        row_idx_lst_lst = [None] * len(table_lst)
+        if row_filter is not None:
+            row_idx_lst_lst = [row_filter.get_rows(a) for a in table_lst]
+        if table_row_budget is not None:
+            row_idx_lst_lst = table_row_budget.get_rows(table_lst, row_idx_lst_lst)
+        for table, row_idx_lst in zip(table_lst, row_idx_lst_lst):
+            graph_stat['all_pair_size'] += get_graph_size(table, row_idx_lst)
+            yield (table, row_idx_lst)
 
 def main(args):
     table2txt_dir = os.path.join(args.work_dir, 'open_table_discovery/table2txt')
@@ -29,42 +165,159 @@ def main(args):
         os.makedirs(out_dir)
 
     out_passage_file = os.path.join(out_dir, 'passages.jsonl')
-    if os.path.exists(out_passage_file):
-        err_msg = ('(%s) already exists.\n' % out_passage_file)
+    if args.strategy not in GRAPH_STRATEGY_NAME_LST:
+        err_msg = 'table2graph supports the strategies %s\n' % ', '.join(GRAPH_STRATEGY_NAME_LST)
         print(err_msg)
-        return {'state':False}
-    f_o = open(out_passage_file, 'w')
+        return {'state':False, 'msg':err_msg}
+    pack_size = getattr(args, 'pack_size', 0)
+    incremental = getattr(args, 'incremental', 0)
+    prev_state = None
+    if incremental and jsonl_io.exists(out_passage_file):
+        prev_state = graph_state.read_state(out_passage_file)
+    if incremental or jsonl_io.exists(out_passage_file):
+        msg_info = check_incremental(args, out_passage_file, prev_state)
+        if not msg_info['state']:
+            print(msg_info['msg'])
+            return msg_info
+    remove_shards(out_passage_file)
+    write_mode = 'w'
+    p_id = 0
+    if prev_state is not None:
+        write_mode = 'a'
+        p_id = prev_state['num_passages']
+    else:
+        side_file_lst = [row_budget.get_sample_file(out_passage_file), passage_dedup.get_posting_file(out_passage_file),
+                         graph_state.get_state_file(out_passage_file), graph_state.get_retired_file(out_passage_file),
+                         passage_dedup.get_dedup_map_file(out_passage_file)]
+        for side_file in side_file_lst:
+            if os.path.exists(side_file):
+                os.remove(side_file)
+    start_p_id = p_id
+    shard_size = getattr(args, 'shard_size', 0)
+    compress_ext = get_compress_ext(args)
+    f_o = PassageWriter(out_passage_file, shard_size=shard_size, mode=write_mode, num_passages=p_id,
+                        compress_ext=compress_ext)
 
     table_file_name = args.table_file
     input_table_file = os.path.join(args.work_dir, 'data', args.dataset, 'tables', table_file_name)
-    table_lst = read_tables(input_table_file)
-
-    multi_process = False
-    if multi_process:
-        work_pool = ProcessPool(initializer=init_worker, initargs=(args.strategy,))
-        for graph_lst in tqdm(work_pool.imap_unordered(process_table, table_lst), total=len(table_lst)):
-            write_graphs(graph_lst, f_o) 
-             
+    row_filter = get_row_filter(args, input_table_file)
+    table_row_budget = get_row_budget(args, out_passage_file, write_mode)
+    dedup_passages = getattr(args, 'dedup_passages', 0)
+    # lines of the side files from earlier runs, those of retired tables are dropped at the end of the run
+    num_old_samples = graph_state.count_lines(row_budget.get_sample_file(out_passage_file)) if prev_state else 0
+    num_old_postings = graph_state.count_lines(passage_dedup.get_posting_file(out_passage_file)) if prev_state else 0
+    passage_deduper = None
+    if dedup_passages:
+        dedup_max_passages = getattr(args, 'dedup_max_passages', passage_dedup.MAX_PASSAGES)
+        prev_retired_range_lst = graph_state.read_retired_ranges(out_passage_file) if prev_state else None
+        passage_deduper = passage_dedup.PassageDedup(out_passage_file, max_passages=dedup_max_passages,
+                                                     mode=write_mode, retired_range_lst=prev_retired_range_lst)
+    # with --incremental, only tables added or changed since the previous run are linearized
+    table_diff = graph_state.TableDiff(prev_state, args) if incremental else None
+    graph_stat = {'all_pair_size':0}
+    table_info_itr = iter_table_infos(input_table_file, row_filter, table_row_budget, table_diff, graph_stat)
+
+    # Tables are written in input order by both paths, so p_ids (table ordinal order plus
+    # the offset in the table) are the same for any number of workers.
+    # Tables go through the pool in bounded batches, memory does not grow with the collection size.
+    num_workers = getattr(args, 'num_workers', 1)
+    pbar = tqdm(desc='linearize tables')
+    if num_workers > 1:
+        work_pool = ProcessPool(num_workers, initializer=init_worker, initargs=(args.strategy, dedup_passages, pack_size))
+        chunk_size = getattr(args, 'chunk_size', 16)
+        batch_size = num_workers * chunk_size * 4
+        for table_info_batch in table_store.batch_tables(table_info_itr, batch_size):
+            for passage_lst in work_pool.imap(process_table, table_info_batch, chunksize=chunk_size):
+                p_id = write_graphs(passage_lst, f_o, p_id, passage_deduper, table_diff)
+            pbar.update(len(table_info_batch))
+        work_pool.close()
+        work_pool.join()
     else:
-        init_worker(args.strategy)
-        for table in tqdm(table_lst):
-            graph_lst = process_table(table)
-            write_graphs(graph_lst, f_o) 
+        init_worker(args.strategy, dedup_passages, pack_size)
+        for table_info in table_info_itr:
+            passage_lst = process_table(table_info)
+            p_id = write_graphs(passage_lst, f_o, p_id, passage_deduper, table_diff)
+            pbar.update(1)
+    pbar.close()
 
-    f_o.close()
+    shard_manifest_file = f_o.close()
+    if table_diff is not None:
+        removed_lst = table_diff.close(out_passage_file, p_id)
+        print('%d new tables, %d changed, %d removed, %d unchanged, %d passages retired' % (
+              table_diff.num_new, table_diff.num_changed, len(removed_lst), table_diff.num_unchanged,
+              sum([a['num_passages'] for a in table_diff.retired_lst])))
+    if row_filter is not None:
+        print('%d rows of near-duplicate tables skipped out of %d' % (row_filter.num_skipped_rows, row_filter.num_rows))
+    if passage_deduper is not None:
+        passage_deduper.close(save_map=incremental)
+        print('%d unique passages, %d duplicates stored as postings' % (p_id - start_p_id, passage_deduper.num_postings))
+        if passage_deduper.num_missed > 0:
+            print('dedup table full at %d passages, %d later passages were not added to it' % (
+                  passage_deduper.max_passages, passage_deduper.num_missed))
+    if table_row_budget is not None:
+        table_row_budget.close()
+        print('%d tables over the row budget, %d of their %d rows indexed' % (
+              table_row_budget.num_tables, table_row_budget.num_indexed_rows, table_row_budget.num_rows))
+    retired_range_lst = []
+    kept_p_id_set = set()
+    if table_diff is not None:
+        graph_state.retire_lines(row_budget.get_sample_file(out_passage_file), num_old_samples,
+                                 table_diff.retired_table_set, lambda a: a['table_id'])
+        graph_state.retire_lines(passage_dedup.get_posting_file(out_passage_file), num_old_postings,
+                                 table_diff.retired_table_set, passage_dedup.get_posting_table_id)
+        retired_range_lst = graph_state.read_retired_ranges(out_passage_file)
+        if passage_deduper is not None:
+            kept_p_id_set = passage_dedup.mark_retired_passages(out_passage_file, retired_range_lst)
+    num_graphs = p_id - start_p_id
+    if passage_deduper is not None:
+        num_graphs += passage_deduper.num_postings
+    all_pair_size = graph_stat['all_pair_size']
+    if num_graphs != all_pair_size:
+        reduction = 100 * (1 - num_graphs / max(all_pair_size, 1))
+        print('%d passages, %d with every column pair (%.1f%% fewer)' % (num_graphs, all_pair_size, reduction))
     
     msg_info = {
         'state':True,
-        'out_file':out_passage_file
+        'out_file':out_passage_file + compress_ext,
+        'passage_file':out_passage_file,
+        'start_p_id':start_p_id + 1,
+        'num_passages':p_id - start_p_id,
+        'shard_manifest':shard_manifest_file,
+        # retired passages (other than kept_p_ids) are left out of the index by index_tables --incremental
+        'run':table_diff.run if table_diff is not None else 0,
+        'retired_ranges':retired_range_lst,
+        'kept_p_ids':kept_p_id_set
     }
     return msg_info 
 
-g_passage_id = 0
+def get_compress_ext(args):
+    compress = getattr(args, 'compress', '')
+    return ('.' + compress) if compress else ''
 
-def write_graphs(graph_lst, f_o):
-    global g_passage_id
+def check_incremental(args, out_passage_file, prev_state):
+    # a run can only append to passages.jsonl written by an --incremental run with the same options.
+    # Cluster row skipping depends on the other tables, it is not incremental.
+    err_msg = None
+    if not getattr(args, 'incremental', 0):
+        err_msg = '(%s) already exists.\n' % out_passage_file
+    elif getattr(args, 'skip_cluster_rows', 0):
+        err_msg = '--incremental can not be used with --skip_cluster_rows\n'
+    elif not jsonl_io.exists(out_passage_file):
+        pass
+    elif prev_state is None:
+        err_msg = '(%s) already exists and was not written with --incremental 1.\n' % out_passage_file
+    elif prev_state['args'] != graph_state.get_state_args(args):
+        err_msg = '(%s) was written with %s, remove it to linearize with other options.\n' % (
+                  out_passage_file, json.dumps(prev_state['args']))
+    if err_msg is not None:
+        return {'state':False, 'msg':err_msg}
+    return {'state':True}
+
+def encode_graphs(graph_lst, dedup_passages=0):
+    # json is encoded in the workers without p_id, write_graphs only prefixes the p_id.
+    # With dedup_passages, the passage hash and the tag json are sent too.
+    passage_lst = []
     for graph_info in graph_lst:
-        g_passage_id += 1
         passage = graph_info['graph']
         meta_info = {
             'table_id': graph_info['table_id'],
@@ -72,12 +325,35 @@ def write_graphs(graph_lst, f_o):
             'sub_col':graph_info['sub_col'],
             'obj_col':graph_info['obj_col']
         }
+        if 'col_pairs' in graph_info:
+            meta_info['col_pairs'] = graph_info['col_pairs']
         passage_info = {
-            'p_id':g_passage_id,
             'passage':passage,
             'tag':meta_info    
         }
-        f_o.write(json.dumps(passage_info) + '\n')
+        passage_text = json.dumps(passage_info)[1:]
+        if dedup_passages:
+            passage_lst.append((passage_dedup.get_passage_key(passage), passage_text, json.dumps(meta_info)))
+        else:
+            passage_lst.append((None, passage_text, None))
+    return passage_lst
+
+def write_graphs(passage_lst, f_o, p_id, passage_deduper=None, table_diff=None):
+    # the same bytes as json.dumps({'p_id':p_id, 'passage':passage, 'tag':meta_info})
+    # passage_lst is the passages of one table
+    start_p_id = p_id
+    for passage_key, passage_text, tag_text in passage_lst:
+        if passage_deduper is not None:
+            first_p_id = passage_deduper.get_p_id(passage_key)
+            if first_p_id is not None:
+                passage_deduper.write_posting(first_p_id, tag_text)
+                continue
+            passage_deduper.add(passage_key, p_id + 1)
+        p_id += 1
+        f_o.write('{"p_id": %d, %s\n' % (p_id, passage_text))
+    if table_diff is not None:
+        table_diff.add_passages(start_p_id + 1, p_id - start_p_id)
+    return p_id
 
 def get_args():
     parser = argparse.ArgumentParser()
@@ -87,6 +363,17 @@ def get_args():
     parser.add_argument('--experiment', type=str)
     parser.add_argument('--strategy', type=str)
     parser.add_argument('--debug', type=int, default=0)
+    parser.add_argument('--skip_cluster_rows', type=int, default=0)
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk_size', type=int, default=16)
+    parser.add_argument('--shard_size', type=int, default=0)
+    parser.add_argument('--max_table_rows', type=int, default=0)
+    parser.add_argument('--dedup_passages', type=int, default=0)
+    parser.add_argument('--dedup_max_passages', type=int, default=passage_dedup.MAX_PASSAGES)
+    parser.add_argument('--incremental', type=int, default=0)
+    parser.add_argument('--pack_size', type=int, default=0)
+    parser.add_argument('--row_seed', type=int, default=0)
+    parser.add_argument('--compress', type=str, default='', choices=['', 'zst', 'gz'])
     args = parser.parse_args()
     return args
 
@@ -5,6 +5,8 @@ from tqdm import tqdm
 import csv
 import argparse
 from table2txt.retr_utils import process_train, process_dev
+import table_store
+import jsonl_io
 
 def get_args():
     parser = argparse.ArgumentParser()
@@ -38,7 +40,7 @@ def print_args(args):
 def main():
     args = get_args()
     out_file = get_out_file(args)
-    if os.path.exists(out_file):
+    if jsonl_io.exists(out_file):
         print('(%s) already exists' % out_file)
         return
     print_args(args)
@@ -48,7 +50,7 @@ def output_data(args, out_dev_file):
     data_dir = get_data_dir(args)
     data_file = os.path.join(data_dir, 'fusion_retrieved.jsonl')
     retr_data = []
-    with open(data_file) as f:
+    with jsonl_io.open_file(data_file) as f:
         for line in tqdm(f):
             item = json.loads(line)
             retr_data.append(item)
@@ -68,16 +70,10 @@ def output_data(args, out_dev_file):
 
 def read_tables(args):
     table_file = '/home/cc/code/data/%s/tables/tables.jsonl' % args.dataset
-    table_dict = {}
-    with open(table_file) as f:
-        for line in tqdm(f):
-            item = json.loads(line)
-            table_id = item['tableId']
-            table_dict[table_id] = item
-    return table_dict
+    return table_store.load_table_dict(table_file)
 
 def write_data(data, out_file):
-    with open(out_file, 'w') as f:
+    with jsonl_io.open_file(out_file, 'w') as f:
         for item in tqdm(data):
             f.write(json.dumps(item) + '\n')
 
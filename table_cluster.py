@@ -0,0 +1,288 @@
+import json
+import os
+import argparse
+import zlib
+import hashlib
+import time
+import numpy as np
+from tqdm import tqdm
+from multiprocessing import Pool as ProcessPool
+import table_store
+
+# Near-duplicate table clustering with MinHash and LSH banding.
+# Each table is a set of shingles (column names and (column name, cell) pairs), hashed by num_perm
+# multiply-shift hash functions. Tables sharing a band of their signatures are candidates, and a candidate
+# is merged into a cluster when the estimated Jaccard similarity is at least the threshold.
+
+MAX_SHINGLES = 100000
+
+CLUSTER_VERSION = 1
+
+def get_cluster_file(table_file):
+    cluster_file = os.path.join(os.path.dirname(table_file), 'table_clusters.jsonl')
+    return cluster_file
+
+# The clusters are of one version of the table file, kept next to the cluster file as its size and mtime
+# (like the table profiles of table2sql), so they are rebuilt after the table file changes and readers
+# ignore stale ones.
+
+def get_cluster_source_file(cluster_file):
+    return cluster_file + '_source.json'
+
+def get_table_source(table_file):
+    source_stat = os.stat(table_file)
+    return [CLUSTER_VERSION, source_stat.st_size, source_stat.st_mtime_ns]
+
+def read_cluster_source(cluster_file):
+    source_file = get_cluster_source_file(cluster_file)
+    if not os.path.exists(source_file):
+        return None
+    with open(source_file) as f:
+        return json.load(f)
+
+def is_cluster_file_updated(table_file, cluster_args=None):
+    # cluster_args, if given, are the clustering args the clusters must also be built with
+    cluster_file = get_cluster_file(table_file)
+    if not os.path.exists(cluster_file):
+        return False
+    source = read_cluster_source(cluster_file)
+    if source is None or source['table'] != get_table_source(table_file):
+        return False
+    if cluster_args is not None and source['args'] != cluster_args:
+        return False
+    return True
+
+def get_hash_params(num_perm, seed):
+    rng = np.random.RandomState(seed)
+    hash_a = rng.randint(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    hash_b = rng.randint(0, 2**63, size=num_perm, dtype=np.uint64)
+    return hash_a, hash_b
+
+def get_shingles(table):
+    col_name_lst = [a['text'].strip().lower() for a in table['columns'] or []]
+    shingle_set = set(['[C] ' + a for a in col_name_lst])
+    for row_info in table['rows']:
+        for col, cell_info in enumerate(row_info['cells']):
+            shingle_set.add(col_name_lst[col] + ' [V] ' + cell_info['text'].strip().lower())
+        if len(shingle_set) >= MAX_SHINGLES:
+            break
+    return shingle_set
+
+def get_signature(table, hash_a, hash_b):
+    shingle_set = get_shingles(table)
+    if len(shingle_set) == 0:
+        return None
+    shingle_hashes = np.array([zlib.crc32(a.encode('utf-8')) for a in shingle_set], dtype=np.uint64)
+    # (a * x + b) mod 2^64, the high 32 bits are the hash value
+    hash_values = (hash_a[:, None] * shingle_hashes[None, :] + hash_b[:, None]) >> np.uint64(32)
+    signature = hash_values.min(axis=1).astype(np.uint32)
+    return signature
+
+def init_worker(num_perm, seed):
+    global g_hash_a
+    global g_hash_b
+    g_hash_a, g_hash_b = get_hash_params(num_perm, seed)
+
+def process_table(table):
+    return (table['tableId'], table_store.get_parent_table_id(table), get_signature(table, g_hash_a, g_hash_b))
+
+def compute_signatures(table_file, num_perm, seed, num_workers):
+    table_id_lst = []
+    parent_id_lst = []
+    signature_lst = []
+    table_itr = table_store.iter_tables(table_file)
+    if num_workers > 1:
+        work_pool = ProcessPool(num_workers, initializer=init_worker, initargs=(num_perm, seed))
+        for table_batch in table_store.batch_tables(table_itr, num_workers * 256):
+            for table_id, parent_id, signature in work_pool.imap(process_table, table_batch, chunksize=64):
+                table_id_lst.append(table_id)
+                parent_id_lst.append(parent_id)
+                signature_lst.append(signature)
+        work_pool.close()
+        work_pool.join()
+    else:
+        init_worker(num_perm, seed)
+        for table in table_itr:
+            table_id, parent_id, signature = process_table(table)
+            table_id_lst.append(table_id)
+            parent_id_lst.append(parent_id)
+            signature_lst.append(signature)
+    return table_id_lst, parent_id_lst, signature_lst
+
+def find_root(parent, idx):
+    while parent[idx] != idx:
+        parent[idx] = parent[parent[idx]]
+        idx = parent[idx]
+    return idx
+
+def cluster_signatures(signature_lst, num_bands, threshold):
+    N = len(signature_lst)
+    parent = list(range(N))
+    valid_lst = [idx for idx in range(N) if signature_lst[idx] is not None]
+    if len(valid_lst) == 0:
+        return parent
+    num_perm = len(signature_lst[valid_lst[0]])
+    band_size = num_perm // num_bands
+    for band in tqdm(range(num_bands), desc='lsh bands'):
+        start = band * band_size
+        bucket_dict = {}
+        for idx in valid_lst:
+            key = signature_lst[idx][start:(start + band_size)].tobytes()
+            first_idx = bucket_dict.get(key, None)
+            if first_idx is None:
+                bucket_dict[key] = idx
+                continue
+            # compare with the first table of the bucket only, so a bucket costs linear time
+            root_1 = find_root(parent, first_idx)
+            root_2 = find_root(parent, idx)
+            if root_1 == root_2:
+                continue
+            similarity = np.mean(signature_lst[first_idx] == signature_lst[idx])
+            if similarity >= threshold:
+                parent[max(root_1, root_2)] = min(root_1, root_2)
+    return parent
+
+def get_clusters(table_id_lst, parent):
+    # clusters with more than one table, the first table in collection order is the representative
+    cluster_dict = {}
+    for idx in range(len(table_id_lst)):
+        root = find_root(parent, idx)
+        if root not in cluster_dict:
+            cluster_dict[root] = []
+        cluster_dict[root].append(table_id_lst[idx])
+    cluster_lst = [cluster_dict[a] for a in sorted(cluster_dict.keys()) if len(cluster_dict[a]) > 1]
+    return cluster_lst
+
+def read_table_clusters(table_file, parent_ids=False):
+    # tableId -> list of the tableIds in its near-duplicate cluster (itself included)
+    # with parent_ids, table chunks are replaced by their parent tables
+    cluster_file = get_cluster_file(table_file)
+    table_cluster_dict = {}
+    if not os.path.exists(cluster_file):
+        return table_cluster_dict
+    if not is_cluster_file_updated(table_file):
+        print('(%s) is not of the current %s, ignored, run table_cluster.py to rebuild it' % (
+              cluster_file, table_file))
+        return table_cluster_dict
+    with open(cluster_file) as f:
+        for line in f:
+            item = json.loads(line)
+            table_id_lst = item['table_id_lst']
+            if parent_ids:
+                table_id_lst = item.get('parent_table_id_lst', table_id_lst)
+            for table_id in table_id_lst:
+                table_cluster_dict[table_id] = table_id_lst
+    return table_cluster_dict
+
+def load_dataset_table_clusters(work_dir, dataset, parent_ids=False):
+    return read_table_clusters(table_store.get_table_file(work_dir, dataset), parent_ids=parent_ids)
+
+def get_row_key(row_info):
+    row_text = '\t'.join([a['text'].strip().lower() for a in row_info['cells']])
+    return hashlib.blake2b(row_text.encode('utf-8'), digest_size=8).digest()
+
+class ClusterRowFilter:
+    # Keeps the rows of a clustered table that no other table of the same cluster has already emitted,
+    # so the indexer only linearizes rows that differ between near-duplicate revisions.
+    def __init__(self, table_cluster_dict):
+        self.table_cluster_dict = table_cluster_dict
+        self.cluster_row_dict = {}
+        self.num_rows = 0
+        self.num_skipped_rows = 0
+
+    def get_rows(self, table):
+        row_data = table['rows']
+        self.num_rows += len(row_data)
+        cluster = self.table_cluster_dict.get(table['tableId'], None)
+        if cluster is None:
+            return list(range(len(row_data)))
+        cluster_key = cluster[0]
+        if cluster_key not in self.cluster_row_dict:
+            self.cluster_row_dict[cluster_key] = set()
+        seen_row_set = self.cluster_row_dict[cluster_key]
+        row_idx_lst = []
+        for row_idx, row_info in enumerate(row_data):
+            row_key = get_row_key(row_info)
+            if row_key in seen_row_set:
+                self.num_skipped_rows += 1
+                continue
+            seen_row_set.add(row_key)
+            row_idx_lst.append(row_idx)
+        return row_idx_lst
+
+def main(args):
+    table_file = table_store.get_table_file(args.work_dir, args.dataset)
+    out_file = get_cluster_file(table_file)
+    if args.num_perm % args.num_bands != 0:
+        msg_info = {
+            'state':False,
+            'msg':'--num_perm must be a multiple of --num_bands'
+        }
+        return msg_info
+    cluster_args = {
+        'num_perm':args.num_perm,
+        'num_bands':args.num_bands,
+        'threshold':args.threshold,
+        'seed':args.seed
+    }
+    if is_cluster_file_updated(table_file, cluster_args):
+        print('(%s) is up to date' % out_file)
+        msg_info = {
+            'state':True,
+            'out_file':out_file
+        }
+        return msg_info
+    # the table file version is taken before it is read, so a change during clustering makes the clusters stale
+    source = {
+        'table':get_table_source(table_file),
+        'args':cluster_args
+    }
+
+    t1 = time.time()
+    table_id_lst, parent_id_lst, signature_lst = compute_signatures(table_file, args.num_perm, args.seed,
+                                                                    args.num_workers)
+    parent = cluster_signatures(signature_lst, args.num_bands, args.threshold)
+    cluster_lst = get_clusters(table_id_lst, parent)
+    parent_id_dict = dict(zip(table_id_lst, parent_id_lst))
+    tmp_file = out_file + '.tmp'
+    with open(tmp_file, 'w') as f_o:
+        for cluster_id, cluster in enumerate(cluster_lst):
+            # the records of table chunks and, for readers of whole tables, the tables they belong to
+            item = {
+                'cluster_id':cluster_id,
+                'table_id_lst':cluster,
+                'parent_table_id_lst':list(dict.fromkeys([parent_id_dict[a] for a in cluster]))
+            }
+            f_o.write(json.dumps(item) + '\n')
+    os.replace(tmp_file, out_file)
+    source_file = get_cluster_source_file(out_file)
+    with open(source_file + '.tmp', 'w') as f_o:
+        json.dump(source, f_o)
+    os.replace(source_file + '.tmp', source_file)
+    t2 = time.time()
+    num_clustered = sum([len(a) for a in cluster_lst])
+    print('%d tables, %d near-duplicate clusters covering %d tables, %.2f seconds' % (
+          len(table_id_lst), len(cluster_lst), num_clustered, t2 - t1))
+    msg_info = {
+        'state':True,
+        'out_file':out_file
+    }
+    return msg_info
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--work_dir', type=str, required=True)
+    parser.add_argument('--dataset', type=str, required=True)
+    parser.add_argument('--num_perm', type=int, default=64)
+    parser.add_argument('--num_bands', type=int, default=8)
+    parser.add_argument('--threshold', type=float, default=0.8)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    args = get_args()
+    msg_info = main(args)
+    if not msg_info['state']:
+        print(msg_info['msg'])
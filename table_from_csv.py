@@ -3,8 +3,13 @@ import csv
 import argparse
 import os
 from tqdm import tqdm
-import uuid
 import glob
+import time
+import hashlib
+import io
+from itertools import islice
+from multiprocessing import Pool as ProcessPool
+import table_store
 
 def get_out_file(args):
     data_dir = os.path.join(args.work_dir, 'data/%s/tables' % args.dataset)
@@ -13,6 +18,89 @@ def get_out_file(args):
     data_file = os.path.join(data_dir, 'tables.jsonl')
     return data_file
 
+def get_manifest_file(table_file):
+    manifest_file = os.path.join(os.path.dirname(table_file), 'tables_manifest.json')
+    return manifest_file
+
+def read_manifest(manifest_file):
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    return manifest
+
+def write_manifest(manifest, manifest_file):
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w') as f_o:
+        f_o.write(json.dumps(manifest))
+    os.replace(tmp_file, manifest_file)
+
+def truncate_to_manifest(table_file, manifest):
+    # records appended after the last manifest write (an interrupted run) are dropped, the next run imports
+    # their files again
+    end_offset = max([a['offset'] + a['length'] for a in manifest.values() if a.get('offset', None) is not None],
+                     default=0)
+    if os.path.getsize(table_file) > end_offset:
+        print('(%s) has records not in the manifest, truncated to %d bytes' % (table_file, end_offset))
+        with open(table_file, 'r+b') as f_o:
+            f_o.truncate(end_offset)
+
+def get_alias_file(table_file):
+    alias_file = os.path.join(os.path.dirname(table_file), 'table_alias.json')
+    return alias_file
+
+def write_table_alias(file_dict, alias_file):
+    # representative tableId -> tableIds of the exact duplicates that were not imported
+    alias_dict = {}
+    for rel_path in sorted(file_dict.keys()):
+        entry = file_dict[rel_path]
+        if entry.get('alias_of', None) is None:
+            continue
+        if entry['alias_of'] not in alias_dict:
+            alias_dict[entry['alias_of']] = []
+        alias_dict[entry['alias_of']].append(entry['table_id'])
+    with open(alias_file, 'w') as f_o:
+        f_o.write(json.dumps(alias_dict))
+    return alias_dict
+
+def get_meta_file(csv_file):
+    return os.path.splitext(csv_file)[0] + '.meta'
+
+def get_file_stat(csv_file):
+    stat = os.stat(csv_file)
+    file_stat = {
+        'size':stat.st_size,
+        'mtime':stat.st_mtime_ns,
+        'meta_size':None,
+        'meta_mtime':None
+    }
+    meta_file = get_meta_file(csv_file)
+    if os.path.exists(meta_file):
+        meta_stat = os.stat(meta_file)
+        file_stat['meta_size'] = meta_stat.st_size
+        file_stat['meta_mtime'] = meta_stat.st_mtime_ns
+    return file_stat
+
+def same_file_stat(entry, file_stat):
+    for key in file_stat:
+        if entry.get(key) != file_stat[key]:
+            return False
+    return True
+
+def get_file_hash(csv_file):
+    hash_obj = hashlib.sha1()
+    block_size = 1024 * 1024
+    for data_file in [csv_file, get_meta_file(csv_file)]:
+        if not os.path.exists(data_file):
+            continue
+        with open(data_file, 'rb') as f:
+            block = f.read(block_size)
+            while block:
+                hash_obj.update(block)
+                block = f.read(block_size)
+        hash_obj.update(b'\0')
+    return hash_obj.hexdigest()
+
 def read_meta(meta_file):
     table_title = ''
     table_id = ''
@@ -30,13 +118,28 @@ def read_meta(meta_file):
                     table_id = text[pos:]
     return (table_title, table_id)
 
-def read_table(csv_file, meta_file):
+def get_table_id(file_name, rel_path, file_hash):
+    # content addressed, so re-importing an unchanged file gives the same id
+    key = rel_path + '\0' + file_hash
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+    table_id = file_name + ' - ' + digest
+    return table_id
+
+def get_table_info(csv_file, meta_file, rel_path=None, file_hash=None):
     file_name = os.path.basename(os.path.splitext(csv_file)[0])
     table_title, table_id = read_meta(meta_file)
     if table_title == '':
         table_title = file_name
     if table_id == '':
-        table_id = file_name + ' - ' + str(uuid.uuid4())
+        if rel_path is None:
+            rel_path = os.path.basename(csv_file)
+        if file_hash is None:
+            file_hash = get_file_hash(csv_file)
+        table_id = get_table_id(file_name, rel_path, file_hash)
+    return (table_title, table_id)
+
+def read_table(csv_file, meta_file, rel_path=None, file_hash=None):
+    table_title, table_id = get_table_info(csv_file, meta_file, rel_path=rel_path, file_hash=file_hash)
     table = {
         'columns':None,
         'rows':[],
@@ -58,28 +161,253 @@ def read_table(csv_file, meta_file):
                 row_data.append(cell_info)
     return table
 
+def write_table_record(f_o, col_name_lst, row_itr, table_id, table_title, chunk_info=None, hash_obj=None):
+    # The same bytes as json.dumps(table), but rows are serialized one at a time.
+    # hash_obj is updated with the table content (title, columns and rows but not ids)
+    if col_name_lst is None:
+        col_text = json.dumps(None)
+    else:
+        col_text = json.dumps([{'text':col_name} for col_name in col_name_lst])
+    if (hash_obj is not None) and (chunk_info is None or chunk_info['rowStart'] == 0):
+        hash_obj.update((json.dumps(table_title) + col_text).encode('utf-8'))
+    f_o.write(('{"columns": %s, "rows": [' % col_text).encode('utf-8'))
+    for row, item in enumerate(row_itr):
+        assert(len(item) == len(col_name_lst))
+        cell_info = {'cells':[{'text':a} for a in item]}
+        row_text = json.dumps(cell_info)
+        if hash_obj is not None:
+            hash_obj.update(row_text.encode('utf-8'))
+        if row > 0:
+            row_text = ', ' + row_text
+        f_o.write(row_text.encode('utf-8'))
+    tail_text = '], "tableId": %s, "documentTitle": %s' % (json.dumps(table_id), json.dumps(table_title))
+    if chunk_info is not None:
+        tail_text += ', "parentTableId": %s, "rowStart": %d' % (json.dumps(chunk_info['parentTableId']), 
+                                                                chunk_info['rowStart'])
+    tail_text += '}\n'
+    f_o.write(tail_text.encode('utf-8'))
+
+def write_table(csv_file, meta_file, f_o, rel_path=None, file_hash=None, max_chunk_rows=0):
+    # Stream a csv table into f_o row by row. If max_chunk_rows > 0, a table with more rows is
+    # split into row-range records that share the parent table id, so at most two chunks are
+    # in memory at the same time. Readers of whole tables merge them back (table_store.merge_table_chunks).
+    # Returns the table id and a canonical content hash used to find exact duplicates.
+    table_title, table_id = get_table_info(csv_file, meta_file, rel_path=rel_path, file_hash=file_hash)
+    hash_obj = hashlib.sha1()
+    with open(csv_file) as f:
+        reader = csv.reader(f, delimiter=',')
+        col_name_lst = next(reader, None)
+        if max_chunk_rows <= 0:
+            write_table_record(f_o, col_name_lst, reader, table_id, table_title, hash_obj=hash_obj)
+            return (table_id, hash_obj.hexdigest())
+        
+        chunk_rows = list(islice(reader, max_chunk_rows))
+        next_chunk_rows = list(islice(reader, max_chunk_rows))
+        if len(next_chunk_rows) == 0:
+            write_table_record(f_o, col_name_lst, chunk_rows, table_id, table_title, hash_obj=hash_obj)
+            return (table_id, hash_obj.hexdigest())
+        
+        chunk_idx = 0
+        row_start = 0
+        while len(chunk_rows) > 0:
+            chunk_info = {
+                'parentTableId':table_id,
+                'rowStart':row_start
+            }
+            chunk_id = table_store.get_chunk_id(table_id, chunk_idx)
+            write_table_record(f_o, col_name_lst, chunk_rows, chunk_id, table_title, 
+                               chunk_info=chunk_info, hash_obj=hash_obj)
+            chunk_idx += 1
+            row_start += len(chunk_rows)
+            chunk_rows = next_chunk_rows
+            next_chunk_rows = list(islice(reader, max_chunk_rows))
+    return (table_id, hash_obj.hexdigest())
+
+def process_csv(csv_info):
+    rel_path, csv_file, stream_min_size, max_chunk_rows = csv_info
+    if (stream_min_size > 0) and (os.path.getsize(csv_file) >= stream_min_size):
+        # large tables are streamed into the output file by the main process
+        out_info = {
+            'table_id':None,
+            'hash':None,
+            'table_hash':None,
+            'data':None
+        }
+        return out_info
+    meta_file = get_meta_file(csv_file)
+    file_hash = get_file_hash(csv_file)
+    buffer = io.BytesIO()
+    table_id, table_hash = write_table(csv_file, meta_file, buffer, rel_path=rel_path, 
+                                       file_hash=file_hash, max_chunk_rows=max_chunk_rows)
+    out_info = {
+        'table_id':table_id,
+        'hash':file_hash,
+        'table_hash':table_hash,
+        'data':buffer.getvalue()
+    }
+    return out_info
+
+def diff_manifest(dataset_dir, csv_file_lst, manifest):
+    # Unchanged files keep their manifest entries; new or modified files are returned to be parsed.
+    # Entries left in the old manifest are for deleted or modified files.
+    csv_dir = os.path.join(dataset_dir, 'tables_csv')
+    file_dict = {}
+    update_lst = []
+    for csv_file in csv_file_lst:
+        rel_path = os.path.relpath(csv_file, csv_dir)
+        file_stat = get_file_stat(csv_file)
+        entry = manifest.get(rel_path, None)
+        if entry is not None:
+            if not same_file_stat(entry, file_stat):
+                if get_file_hash(csv_file) != entry['hash']:
+                    entry = None
+                else:
+                    entry.update(file_stat)
+        if entry is not None:
+            file_dict[rel_path] = entry
+        else:
+            update_lst.append((rel_path, csv_file, file_stat))
+    
+    removed_lst = [a for a in manifest if a not in file_dict]
+    
+    # duplicates whose representative is gone are imported again, the first one becomes the representative
+    rep_id_set = set([a['table_id'] for a in file_dict.values() if a.get('alias_of', None) is None])
+    orphan_lst = []
+    for rel_path in file_dict:
+        alias_of = file_dict[rel_path].get('alias_of', None)
+        if (alias_of is not None) and (alias_of not in rep_id_set):
+            orphan_lst.append(rel_path)
+    for rel_path in orphan_lst:
+        del file_dict[rel_path]
+        csv_file = os.path.join(csv_dir, rel_path)
+        update_lst.append((rel_path, csv_file, get_file_stat(csv_file)))
+    update_lst.sort(key=lambda a: a[0])
+    return file_dict, update_lst, removed_lst
+
+def copy_kept_tables(table_file, file_dict, out_file):
+    # copy the records of unchanged files byte by byte, no json parsing is needed.
+    kept_lst = [a for a in file_dict.values() if a.get('alias_of', None) is None]
+    kept_lst.sort(key=lambda a: a['offset'])
+    offset = 0
+    with open(table_file, 'rb') as f, open(out_file, 'wb') as f_o:
+        for entry in tqdm(kept_lst, desc='copy unchanged tables'):
+            f.seek(entry['offset'])
+            data = f.read(entry['length'])
+            f_o.write(data)
+            entry['offset'] = offset
+            offset += entry['length']
+
 def main(args):
     out_file = get_out_file(args)
-    if os.path.exists(out_file):
+    manifest_file = get_manifest_file(out_file)
+    if os.path.exists(out_file) and (not os.path.exists(manifest_file)):
         msg_text = '(%s) already exists' % out_file
         msg_info = {
             'state':False,
             'msg':msg_text
         }
         return msg_info
-
-    f_o = open(out_file, 'w')
+    
+    manifest = read_manifest(manifest_file)
+    if not os.path.exists(out_file):
+        manifest = {}
+    else:
+        truncate_to_manifest(out_file, manifest)
 
     dataset_dir = os.path.join(args.work_dir, 'data', args.dataset)
     csv_file_pattern = os.path.join(dataset_dir, 'tables_csv', '**', '*.csv')
     csv_file_lst = glob.glob(csv_file_pattern, recursive=True)
-    for csv_file in tqdm(csv_file_lst):
-        meta_file = os.path.splitext(csv_file)[0] + '.meta'
-        table = read_table(csv_file, meta_file)
-        f_o.write(json.dumps(table) + '\n')
+    csv_file_lst.sort() # keep the output order the same across runs and worker counts
     
-    f_o.close()
+    file_dict, update_lst, removed_lst = diff_manifest(dataset_dir, csv_file_lst, manifest)
+    print('%d new or modified tables, %d stale records, %d unchanged' % (
+          len(update_lst), len(removed_lst), len(file_dict)))
+    if (len(update_lst) == 0) and (len(removed_lst) == 0):
+        write_manifest(file_dict, manifest_file)
+        msg_info = {
+            'state':True,
+        }
+        return msg_info
+   
+    tmp_out_file = out_file + '.tmp' 
+    if len(removed_lst) > 0:
+        copy_kept_tables(out_file, file_dict, tmp_out_file)
+        f_o = open(tmp_out_file, 'ab')
+    else:
+        f_o = open(out_file, 'ab')
+    offset = f_o.tell()
 
+    num_workers = getattr(args, 'num_workers', 1)
+    stream_min_size = int(getattr(args, 'stream_min_mb', 0) * 1024 * 1024)
+    max_chunk_rows = getattr(args, 'max_chunk_rows', 0)
+    update_csv_lst = [(a[0], a[1], stream_min_size, max_chunk_rows) for a in update_lst]
+    t1 = time.time()
+    if num_workers > 1:
+        chunk_size = getattr(args, 'chunk_size', 64)
+        work_pool = ProcessPool(num_workers)
+        out_itr = work_pool.imap(process_csv, update_csv_lst, chunksize=chunk_size)
+    else:
+        work_pool = None
+        out_itr = map(process_csv, update_csv_lst)
+   
+    dedup = getattr(args, 'dedup', 1)
+    table_hash_dict = {}
+    for entry in file_dict.values():
+        if (entry.get('alias_of', None) is None) and (entry.get('table_hash', None) is not None):
+            table_hash_dict[entry['table_hash']] = entry['table_id']
+    num_duplicates = 0
+    for idx, out_info in tqdm(enumerate(out_itr), total=len(update_csv_lst)):
+        rel_path, csv_file, file_stat = update_lst[idx]
+        if out_info['data'] is None:
+            file_hash = get_file_hash(csv_file)
+            table_id, table_hash = write_table(csv_file, get_meta_file(csv_file), f_o, rel_path=rel_path,
+                                               file_hash=file_hash, max_chunk_rows=max_chunk_rows)
+        else:
+            file_hash = out_info['hash']
+            table_id = out_info['table_id']
+            table_hash = out_info['table_hash']
+        
+        alias_of = None
+        if dedup and (table_hash in table_hash_dict):
+            # an exact duplicate, only the representative is kept in the table file
+            alias_of = table_hash_dict[table_hash]
+            num_duplicates += 1
+            if out_info['data'] is None:
+                f_o.truncate(offset)
+                f_o.seek(offset)
+        else:
+            table_hash_dict[table_hash] = table_id
+            if out_info['data'] is not None:
+                f_o.write(out_info['data'])
+        
+        entry = {
+            'hash':file_hash,
+            'table_hash':table_hash,
+            'table_id':table_id,
+            'alias_of':alias_of,
+            'offset':None if alias_of is not None else offset,
+            'length':f_o.tell() - offset
+        }
+        entry.update(file_stat)
+        file_dict[rel_path] = entry
+        offset += entry['length']
+    
+    if work_pool is not None:
+        work_pool.close()
+        work_pool.join()
+    
+    f_o.close()
+    if len(removed_lst) > 0:
+        os.replace(tmp_out_file, out_file)
+    write_manifest(file_dict, manifest_file)
+    write_table_alias(file_dict, get_alias_file(out_file))
+    t2 = time.time()
+    
+    num_tables = len(update_csv_lst)
+    time_span = max(t2 - t1, 1e-6)
+    print('%d tables imported in %.2f seconds (%.2f tables/sec), %d exact duplicates skipped' % (
+          num_tables, time_span, num_tables / time_span, num_duplicates))
+    
     msg_info = {
         'state':True,
     }
@@ -89,6 +417,11 @@ def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('--work_dir', type=str)
     parser.add_argument('--dataset', type=str)
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk_size', type=int, default=64)
+    parser.add_argument('--stream_min_mb', type=float, default=64)
+    parser.add_argument('--max_chunk_rows', type=int, default=0)
+    parser.add_argument('--dedup', type=int, default=1)
     args = parser.parse_args()
     return args
 
@@ -0,0 +1,504 @@
+import json
+import os
+import struct
+import argparse
+import mmap
+from collections import OrderedDict
+from tqdm import tqdm
+import jsonl_io
+
+# Binary columnar table file (.tbl), an alternative to tables.jsonl
+#
+#   MAGIC
+#   table records, one per table
+#       tableId, documentTitle, extra (json of the other table fields or '')  : length-prefixed strings
+#       num_cols (u32), num_rows (u32)
+#       column name ids (u32 * num_cols), ids into the interned column names
+#       for each column: byte size of the column (u32) and the utf-8 cell texts joined by NUL, so a column is
+#       decoded with one decode and one split. A column with a NUL in a cell has NO_SEP_COL as the size,
+#       then cell byte sizes (u32 * num_rows) followed by the cell texts.
+#   footer
+#       interned column names : count (u32) + length-prefixed strings
+#       table index           : count (u32) + (tableId, offset (u64), size (u64)) per table
+#   footer offset (u64), MAGIC
+
+MAGIC = b'OTDTBL02'
+TABLE_FILE_EXT = '.tbl'
+
+U32 = struct.Struct('<I')
+U64 = struct.Struct('<Q')
+TRAILER_SIZE = U64.size + len(MAGIC)
+BASE_FIELDS = ['columns', 'rows', 'tableId', 'documentTitle']
+CELL_SEP = b'\0'
+NO_SEP_COL = 0xFFFFFFFF
+
+def pack_text(text):
+    data = text.encode('utf-8')
+    return U32.pack(len(data)) + data
+
+def unpack_text(buf, pos):
+    size = U32.unpack_from(buf, pos)[0]
+    pos += U32.size
+    text = str(buf[pos:(pos + size)], 'utf-8')
+    return text, pos + size
+
+def is_plain_table(table):
+    # only tables shaped like the output of table_from_csv can be stored column by column
+    columns = table.get('columns', None)
+    if columns is None:
+        return False
+    for col_info in columns:
+        if list(col_info.keys()) != ['text']:
+            return False
+    for row_info in table['rows']:
+        if list(row_info.keys()) != ['cells']:
+            return False
+        cells = row_info['cells']
+        if len(cells) != len(columns):
+            return False
+        for cell_info in cells:
+            if list(cell_info.keys()) != ['text']:
+                return False
+    return True
+
+class TableStoreWriter:
+    def __init__(self, out_file):
+        self.out_file = out_file
+        self.f_o = open(out_file, 'wb')
+        self.f_o.write(MAGIC)
+        self.col_name_dict = {}
+        self.col_name_lst = []
+        self.index_lst = []
+
+    def get_col_name_id(self, col_name):
+        name_id = self.col_name_dict.get(col_name, None)
+        if name_id is None:
+            name_id = len(self.col_name_lst)
+            self.col_name_dict[col_name] = name_id
+            self.col_name_lst.append(col_name)
+        return name_id
+
+    def write(self, table):
+        plain = is_plain_table(table)
+        if plain:
+            extra_fields = [a for a in table if a not in BASE_FIELDS]
+        else:
+            extra_fields = [a for a in table if a not in ['tableId', 'documentTitle']]
+        extra_text = ''
+        if len(extra_fields) > 0:
+            extra_text = json.dumps({a:table[a] for a in extra_fields})
+
+        part_lst = [pack_text(table['tableId']), pack_text(table.get('documentTitle', '')), pack_text(extra_text)]
+        if plain:
+            columns = table['columns']
+            row_data = table['rows']
+            num_cols = len(columns)
+            num_rows = len(row_data)
+            part_lst.append(U32.pack(num_cols) + U32.pack(num_rows))
+            col_name_ids = [self.get_col_name_id(a['text']) for a in columns]
+            part_lst.append(struct.pack('<%dI' % num_cols, *col_name_ids))
+            for col in range(num_cols):
+                cell_data = [row_info['cells'][col]['text'].encode('utf-8') for row_info in row_data]
+                col_data = CELL_SEP.join(cell_data)
+                if col_data.count(CELL_SEP) == max(num_rows - 1, 0):
+                    part_lst.append(U32.pack(len(col_data)))
+                    part_lst.append(col_data)
+                else:
+                    part_lst.append(U32.pack(NO_SEP_COL))
+                    part_lst.append(struct.pack('<%dI' % num_rows, *[len(a) for a in cell_data]))
+                    part_lst.append(b''.join(cell_data))
+        else:
+            part_lst.append(U32.pack(0) + U32.pack(0))
+
+        data = b''.join(part_lst)
+        offset = self.f_o.tell()
+        self.f_o.write(data)
+        self.index_lst.append((table['tableId'], offset, len(data)))
+
+    def close(self):
+        footer_offset = self.f_o.tell()
+        part_lst = [U32.pack(len(self.col_name_lst))]
+        part_lst.extend([pack_text(a) for a in self.col_name_lst])
+        part_lst.append(U32.pack(len(self.index_lst)))
+        for table_id, offset, size in self.index_lst:
+            part_lst.append(pack_text(table_id) + U64.pack(offset) + U64.pack(size))
+        self.f_o.write(b''.join(part_lst))
+        self.f_o.write(U64.pack(footer_offset) + MAGIC)
+        self.f_o.close()
+
+def check_magic(buf):
+    if (bytes(buf[:len(MAGIC)]) != MAGIC) or (bytes(buf[-len(MAGIC):]) != MAGIC):
+        raise ValueError('Not a table store file of this version, convert the tables.jsonl again')
+
+def read_footer(buf):
+    # returns the interned column names and the table index [(tableId, offset, size)]
+    check_magic(buf)
+    pos = U64.unpack_from(buf, len(buf) - TRAILER_SIZE)[0]
+    num_names = U32.unpack_from(buf, pos)[0]
+    pos += U32.size
+    col_name_lst = []
+    for _ in range(num_names):
+        col_name, pos = unpack_text(buf, pos)
+        col_name_lst.append(col_name)
+
+    num_tables = U32.unpack_from(buf, pos)[0]
+    pos += U32.size
+    index_lst = []
+    for _ in range(num_tables):
+        table_id, pos = unpack_text(buf, pos)
+        offset = U64.unpack_from(buf, pos)[0]
+        size = U64.unpack_from(buf, pos + U64.size)[0]
+        pos += 2 * U64.size
+        index_lst.append((table_id, offset, size))
+    return col_name_lst, index_lst
+
+def decode_table(buf, offset, col_name_lst):
+    table_id, pos = unpack_text(buf, offset)
+    title, pos = unpack_text(buf, pos)
+    extra_text, pos = unpack_text(buf, pos)
+    num_cols = U32.unpack_from(buf, pos)[0]
+    num_rows = U32.unpack_from(buf, pos + U32.size)[0]
+    pos += 2 * U32.size
+    col_name_ids = struct.unpack_from('<%dI' % num_cols, buf, pos)
+    pos += num_cols * U32.size
+
+    col_text_lst = []
+    for col in range(num_cols):
+        col_size = U32.unpack_from(buf, pos)[0]
+        pos += U32.size
+        if col_size != NO_SEP_COL:
+            text_lst = str(buf[pos:(pos + col_size)], 'utf-8').split('\0') if num_rows > 0 else []
+            pos += col_size
+        else:
+            size_lst = struct.unpack_from('<%dI' % num_rows, buf, pos)
+            pos += num_rows * U32.size
+            text_lst = []
+            for size in size_lst:
+                text_lst.append(str(buf[pos:(pos + size)], 'utf-8'))
+                pos += size
+        col_text_lst.append(text_lst)
+
+    row_text_itr = zip(*col_text_lst) if num_cols > 0 else [()] * num_rows
+    table = {
+        'columns':[{'text':col_name_lst[a]} for a in col_name_ids],
+        'rows':[{'cells':[{'text':a} for a in row_texts]} for row_texts in row_text_itr],
+        'tableId':table_id,
+        'documentTitle':title
+    }
+    if extra_text != '':
+        extra_info = json.loads(extra_text)
+        if 'rows' in extra_info:
+            table = {a:extra_info[a] for a in ['columns', 'rows']}
+            table['tableId'] = table_id
+            table['documentTitle'] = title
+        for key in extra_info:
+            if key not in table:
+                table[key] = extra_info[key]
+    return table
+
+def is_table_store(table_file):
+    return table_file.endswith(TABLE_FILE_EXT)
+
+def iter_tables(table_file, show_progress=True):
+    if not is_table_store(table_file):
+        with jsonl_io.open_file(table_file) as f:
+            for line in tqdm(f, disable=(not show_progress)):
+                yield json.loads(line)
+        return
+    with open(table_file, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        col_name_lst, index_lst = read_footer(buf)
+        for _, offset, _ in tqdm(index_lst, disable=(not show_progress)):
+            yield decode_table(buf, offset, col_name_lst)
+        buf.close()
+
+# table_from_csv can write a long table as row-range chunk records '<tableId> - part_N', in order, each with
+# parentTableId and rowStart. Readers of whole tables merge the chunks back into the parent table, streaming
+# readers (iter_tables) see the chunks.
+
+def get_chunk_id(table_id, chunk_idx):
+    return '%s - part_%d' % (table_id, chunk_idx)
+
+def get_parent_table_id(table):
+    return table.get('parentTableId', table['tableId'])
+
+def get_row_start(table):
+    return table.get('rowStart', 0)
+
+def group_table_chunks(table_itr):
+    # lists of the consecutive chunk records of one parent table, any other table is a list of its own
+    group = []
+    for table in table_itr:
+        parent_id = table.get('parentTableId', None)
+        if (len(group) > 0) and ((parent_id is None) or (parent_id != group[0].get('parentTableId', None))):
+            yield group
+            group = []
+        group.append(table)
+    if len(group) > 0:
+        yield group
+
+def merge_table_chunks(table_itr):
+    merged_table = None
+    for table in table_itr:
+        parent_id = table.get('parentTableId', None)
+        if (merged_table is not None) and (parent_id == merged_table['tableId']):
+            merged_table['rows'].extend(table['rows'])
+            continue
+        if merged_table is not None:
+            yield merged_table
+            merged_table = None
+        if parent_id is None:
+            yield table
+        else:
+            merged_table = {a:table[a] for a in table if a not in ['parentTableId', 'rowStart']}
+            merged_table['tableId'] = parent_id
+    if merged_table is not None:
+        yield merged_table
+
+def read_tables(table_file):
+    return list(merge_table_chunks(iter_tables(table_file)))
+
+def batch_tables(table_itr, batch_size):
+    # groups a table stream into lists of at most batch_size, so pools only hold one batch at a time
+    batch = []
+    for table in table_itr:
+        batch.append(table)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+def resolve_table_file(table_file):
+    # a .tbl is read only when it is given explicitly, it decodes a little faster than json but builds the
+    # same tables, so it is not preferred over tables.jsonl
+    if is_table_store(table_file):
+        return table_file
+    return jsonl_io.resolve_file(table_file)
+
+def get_table_file(work_dir, dataset):
+    table_file = os.path.join(work_dir, 'data', dataset, 'tables', 'tables.jsonl')
+    return resolve_table_file(table_file)
+
+def get_store_file(table_file):
+    # tables.tbl next to tables.jsonl (or tables.jsonl.zst)
+    if jsonl_io.is_compressed(table_file):
+        table_file = os.path.splitext(table_file)[0]
+    return os.path.splitext(table_file)[0] + TABLE_FILE_EXT
+
+def is_store_updated(table_file):
+    store_file = get_store_file(table_file)
+    if not os.path.exists(store_file):
+        return False
+    return (not os.path.exists(table_file)) or (os.path.getmtime(store_file) >= os.path.getmtime(table_file))
+
+def update_store_file(table_file):
+    # writes tables.tbl for TableStore, unless it is newer than table_file
+    if is_store_updated(table_file):
+        return
+    store_file = get_store_file(table_file)
+    tmp_file = store_file + '.tmp'
+    jsonl_to_store(table_file, tmp_file)
+    os.replace(tmp_file, store_file)
+
+def read_table_alias(table_file):
+    # representative tableId -> ids of the exact duplicates dropped by table_from_csv
+    alias_file = os.path.join(os.path.dirname(table_file), 'table_alias.json')
+    if not os.path.exists(alias_file):
+        return {}
+    with open(alias_file) as f:
+        alias_dict = json.load(f)
+    return alias_dict
+
+def load_dataset_table_alias(work_dir, dataset):
+    return read_table_alias(get_table_file(work_dir, dataset))
+
+# Process level cache, so a run parses the table collection only once no matter how many stages read it.
+# Tables are shared between callers and must be treated as read-only.
+g_table_cache = {}
+
+def get_cache_key(table_file):
+    stat = os.stat(table_file)
+    return (os.path.abspath(table_file), stat.st_size, stat.st_mtime_ns)
+
+def load_tables(table_file):
+    table_file = resolve_table_file(table_file)
+    cache_key = get_cache_key(table_file)
+    cache_item = g_table_cache.get(cache_key, None)
+    if cache_item is None:
+        for key in [a for a in g_table_cache if a[0] == cache_key[0]]:
+            del g_table_cache[key] # the file has changed since it was loaded
+        cache_item = {
+            'table_lst':read_tables(table_file),
+            'table_dict':None
+        }
+        g_table_cache[cache_key] = cache_item
+    return cache_item['table_lst']
+
+def load_table_dict(table_file):
+    load_tables(table_file)
+    cache_item = g_table_cache[get_cache_key(resolve_table_file(table_file))]
+    if cache_item['table_dict'] is None:
+        cache_item['table_dict'] = {table['tableId']:table for table in cache_item['table_lst']}
+    return cache_item['table_dict']
+
+def load_dataset_tables(work_dir, dataset):
+    return load_tables(get_table_file(work_dir, dataset))
+
+def load_dataset_table_dict(work_dir, dataset):
+    return load_table_dict(get_table_file(work_dir, dataset))
+
+def clear_table_cache():
+    g_table_cache.clear()
+
+def get_jsonl_index_file(jsonl_file):
+    return jsonl_file + '.idx'
+
+def build_jsonl_index(jsonl_file):
+    # line offsets of a tables.jsonl, cached in a sidecar file and rebuilt when the table file changes
+    stat = os.stat(jsonl_file)
+    index_file = get_jsonl_index_file(jsonl_file)
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            index_info = json.load(f)
+        if (index_info['size'] == stat.st_size) and (index_info['mtime'] == stat.st_mtime_ns):
+            return [tuple(a) for a in index_info['index']]
+
+    index_lst = []
+    offset = 0
+    with open(jsonl_file, 'rb') as f:
+        for line in tqdm(f, desc='index tables'):
+            table_id = json.loads(line)['tableId']
+            index_lst.append((table_id, offset, len(line)))
+            offset += len(line)
+    index_info = {
+        'size':stat.st_size,
+        'mtime':stat.st_mtime_ns,
+        'index':index_lst
+    }
+    with open(index_file, 'w') as f_o:
+        f_o.write(json.dumps(index_info))
+    return index_lst
+
+class TableStore:
+    # Random access to tables by tableId over a memory mapped .tbl or tables.jsonl file.
+    # Decoded tables are kept in an LRU cache, so memory is proportional to the tables touched.
+    # It can be used wherever a table_dict (tableId -> table) is read.
+    def __init__(self, table_file, cache_size=1000):
+        self.table_file = table_file
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.is_store = is_table_store(table_file)
+        if jsonl_io.is_compressed(table_file):
+            raise ValueError('(%s) is compressed and can not be memory mapped, convert it to %s' % (
+                             table_file, TABLE_FILE_EXT))
+        self.f = open(table_file, 'rb')
+        self.buf = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.is_store:
+            self.col_name_lst, index_lst = read_footer(self.buf)
+        else:
+            self.col_name_lst = None
+            index_lst = build_jsonl_index(table_file)
+        self.offset_dict = {table_id:(offset, size) for table_id, offset, size in index_lst}
+
+    def __len__(self):
+        return len(self.offset_dict)
+
+    def __contains__(self, table_id):
+        return (table_id in self.offset_dict) or (get_chunk_id(table_id, 0) in self.offset_dict)
+
+    def __getitem__(self, table_id):
+        return self.get_table(table_id)
+
+    def keys(self):
+        return self.offset_dict.keys()
+
+    def get_table(self, table_id):
+        table = self.cache.get(table_id, None)
+        if table is not None:
+            self.cache.move_to_end(table_id)
+            return table
+        if table_id in self.offset_dict:
+            table = self.read_record(table_id)
+        else:
+            # a table imported in chunks
+            chunk_id_lst = []
+            while get_chunk_id(table_id, len(chunk_id_lst)) in self.offset_dict:
+                chunk_id_lst.append(get_chunk_id(table_id, len(chunk_id_lst)))
+            if len(chunk_id_lst) == 0:
+                raise KeyError(table_id)
+            table = next(merge_table_chunks(self.read_record(a) for a in chunk_id_lst))
+        self.cache[table_id] = table
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return table
+
+    def read_record(self, table_id):
+        offset, size = self.offset_dict[table_id]
+        if self.is_store:
+            return decode_table(self.buf, offset, self.col_name_lst)
+        return json.loads(self.buf[offset:(offset + size)])
+
+    def get_row(self, table_id, row):
+        return self.get_table(table_id)['rows'][row]
+
+    def get_cell(self, table_id, row, col):
+        return self.get_row(table_id, row)['cells'][col]
+
+    def close(self):
+        self.cache.clear()
+        self.buf.close()
+        self.f.close()
+
+def open_table_store(work_dir, dataset, cache_size=1000):
+    # tables.tbl when it is up to date (index_tables writes it), it opens without a pass over the tables
+    table_file = get_table_file(work_dir, dataset)
+    if is_store_updated(table_file):
+        table_file = get_store_file(table_file)
+    return TableStore(table_file, cache_size=cache_size)
+
+def jsonl_to_store(jsonl_file, out_file):
+    writer = TableStoreWriter(out_file)
+    for table in iter_tables(jsonl_file):
+        writer.write(table)
+    writer.close()
+
+def store_to_jsonl(table_file, out_file):
+    with jsonl_io.open_file(out_file, 'w') as f_o:
+        for table in iter_tables(table_file):
+            f_o.write(json.dumps(table) + '\n')
+
+def main(args):
+    if os.path.exists(args.output):
+        msg_info = {
+            'state':False,
+            'msg':'(%s) already exists' % args.output
+        }
+        return msg_info
+    if is_table_store(args.output):
+        jsonl_to_store(args.input, args.output)
+    elif is_table_store(args.input):
+        store_to_jsonl(args.input, args.output)
+    else:
+        msg_info = {
+            'state':False,
+            'msg':'Either --input or --output must be a %s file' % TABLE_FILE_EXT
+        }
+        return msg_info
+    msg_info = {
+        'state':True
+    }
+    return msg_info
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', type=str, required=True)
+    parser.add_argument('--output', type=str, required=True)
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    args = get_args()
+    msg_info = main(args)
+    if not msg_info['state']:
+        print(msg_info['msg'])
@@ -5,7 +5,8 @@ import glob
 import shutil
 
 import finetune_table_retr as model_tester
-from trainer import read_config, read_tables, retr_triples, get_train_date_dir
+from trainer import read_config, retr_triples, get_train_date_dir
+from table_store import open_table_store
 from src.ondisk_index import OndiskIndexer
 
 def main(args, table_data=None, index_obj=None):
@@ -29,14 +30,16 @@ def main(args, table_data=None, index_obj=None):
         if con_opt == 'q':
             return
          
-    if table_data is None: 
-        table_dict = read_tables(args.work_dir, args.dataset)
-    else:
-        table_dict = table_data
     if con_opt == '2':
         if os.path.isdir(retr_test_dir):
             shutil.rmtree(retr_test_dir)
+        if table_data is None: 
+            table_dict = open_table_store(args.work_dir, args.dataset)
+        else:
+            table_dict = table_data
         retr_triples('test', args.work_dir, args.dataset, test_query_dir, table_dict, False, config, index_obj=index_obj)
+        if table_data is None:
+            table_dict.close()
     test_args = get_test_args(args.work_dir, args.dataset, retr_test_dir, config)
     msg_info = model_tester.main(test_args)
     return msg_info['out_dir'] 
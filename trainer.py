@@ -7,7 +7,11 @@ from tqdm import tqdm
 import uuid
 from table2question import table2sql, gen_fusion_query
 import passage_ondisk_retrieval
-from table2txt.retr_utils import process_train, process_dev
+import table_store
+import jsonl_io
+from table2txt.retr_utils import process_train, process_dev, add_table_aliases, add_skipped_rows
+from table2txt import row_budget
+from table2txt import passage_dedup
 import finetune_table_retr as model_trainer
 import datetime
 from enum import Enum
@@ -49,7 +53,9 @@ def get_sql_args(work_dir, dataset, config):
                                   table_file='tables.jsonl',
                                   experiment='sql_data',
                                   dev_table_pct=float(config['dev_table_pct']),
-                                  num_dev_queries=int(config['dev_n'])
+                                  num_dev_queries=int(config['dev_n']),
+                                  num_workers=os.cpu_count(),
+                                  seed=config.get('sql_seed', None)
                                  )
     return sql_args 
 
@@ -197,29 +203,30 @@ def retr_triples(mode, work_dir, dataset, question_dir, table_dict, is_train, co
    
     retr_data = [] 
     data_file = os.path.join(out_retr_dir, 'fusion_retrieved.jsonl') 
-    with open(data_file) as f:
+    with jsonl_io.open_file(data_file) as f:
         for line in tqdm(f):
             item = json.loads(line)
             retr_data.append(item)
+    # passages stored once for several tags are expanded back to one ctx per tag
+    posting_dict = passage_dedup.read_postings(retr_args.passage_file)
+    passage_dedup.expand_passage_tags(retr_data, posting_dict)
+    # and tables dropped as exact duplicates are listed with their representative
+    add_table_aliases(retr_data, table_store.load_dataset_table_alias(work_dir, dataset))
 
     strategy = 'rel_graph'
     top_n = int(config['retr_top_n'])
     min_tables = int(config['min_tables'])
     updated_retr_data = process_func(retr_data, top_n, table_dict, strategy, min_tables)
+    # the retrieved tables over the row budget list the rows left out of the index
+    add_skipped_rows(updated_retr_data, row_budget.read_sampled_rows(retr_args.passage_file))
     out_file = os.path.join(out_retr_dir, 'fusion_retrieved_tagged.jsonl') 
-    with open(out_file, 'w') as f:
+    with jsonl_io.open_file(out_file, 'w') as f:
         for item in tqdm(updated_retr_data):
             f.write(json.dumps(item) + '\n')
 
 def read_tables(work_dir, dataset):
-    table_file = os.path.join(work_dir, 'data', '%s/tables/tables.jsonl' % dataset)
-    table_dict = {}
-    with open(table_file) as f:
-        for line in tqdm(f):
-            item = json.loads(line)
-            table_id = item['tableId']
-            table_dict[table_id] = item
-    return table_dict
+    # tables are decoded when a retrieved passage needs them, not loaded all at once
+    return table_store.open_table_store(work_dir, dataset)
 
 def merge_train_file(train_file_lst):
     if len(train_file_lst) == 1:
@@ -228,11 +235,11 @@ def merge_train_file(train_file_lst):
     
     data = []
     for data_file in train_file_lst:
-        with open(data_file) as f:
+        with jsonl_io.open_file(data_file) as f:
             for line in f:
                 data.append(line)
 
-    with open(cur_file, 'w') as f_o: 
+    with jsonl_io.open_file(cur_file, 'w') as f_o: 
         for item in data:
             f_o.write(item)
 
@@ -281,6 +288,7 @@ def main():
         sql_dict = msg_info['sql_dict']
         train_tables = msg_info['train_tables']
         stat_info = msg_info['stat_info']
+        table_profiles = msg_info['table_profiles']
        
         table_dict = read_tables(args.work_dir, args.dataset)
          
@@ -314,7 +322,9 @@ def main():
         mode = 'train_%d' % train_itr
         train_sql_dir = os.path.join(sql_data_dir, mode)
         if con_opt == ConfirmOption.CreateNew:
-            table2sql.generate_queries(train_sql_dir, mode, train_tables, num_train_queries, stat_info, sql_dict) 
+            table2sql.generate_queries(train_sql_dir, mode, train_tables, num_train_queries, stat_info, sql_dict,
+                                       table_profiles=table_profiles, num_workers=sql_args.num_workers,
+                                       seed=table2sql.get_mode_seed(sql_args.seed, mode))
             
             sql2question(mode, train_sql_dir, args.work_dir, args.dataset) 
             retr_triples(mode, args.work_dir, args.dataset, train_sql_dir, table_dict, True, config)
@@ -351,6 +361,7 @@ def main():
             break
     
     if con_opt == ConfirmOption.CreateNew:
+        table_dict.close()
         if int(config['train_step_n']) > 0:
             update_data_state(args.work_dir, args.dataset)
 